@@ -0,0 +1,73 @@
+""" Measure the checksum throughput on large files: separate MD5 and SHA-1 passes with
+buffered reads, as a file would be hashed for the download cache and again for the manifest,
+against a single pass over a memory map and against several files hashed at once by threads.
+
+The files are freshly written, so they are mostly read from the page cache and the numbers
+show the cost of hashing rather than that of the disk.
+
+Usage:
+	python benchmarks/checksums.py --files 4 --size 256 --workers 4
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+from pride.checksum import checksum_files, file_checksums
+
+MB=1024*1024
+
+def create_files(directory, files, size):
+	paths=list()
+	for i in range(files):
+		paths.append(os.path.join(directory, 'raw_%d.raw' % i))
+		with open(paths[-1], 'wb') as _file:
+			for block in range(size):
+				_file.write(os.urandom(MB))
+	return paths
+
+def buffered_checksum(path, algorithm):
+	checksum=hashlib.new(algorithm)
+	with open(path, 'rb') as _file:
+		for block in iter(lambda: _file.read(MB), b''):
+			checksum.update(block)
+	return checksum.hexdigest()
+
+def separate_passes(paths):
+	return dict((path, (buffered_checksum(path, 'md5'), buffered_checksum(path, 'sha1'))) for path in paths)
+
+def single_pass(paths):
+	return dict((path, file_checksums(path)) for path in paths)
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark file checksums.')
+	parser.add_argument('--files', type=int, default=4, help='number of files')
+	parser.add_argument('--size', type=int, default=256, help='size of every file in MB')
+	parser.add_argument('--workers', type=int, default=4, help='threads hashing files at once')
+	args=parser.parse_args()
+
+	work_dir=tempfile.mkdtemp()
+	try:
+		paths=create_files(work_dir, args.files, args.size)
+		total=args.files*args.size
+
+		results=list()
+		for name, run in [('separate md5 and sha1 passes', separate_passes),
+		                  ('single mmap pass', single_pass),
+		                  ('single mmap pass, %d threads' % args.workers, lambda paths: checksum_files(paths, args.workers))]:
+			start=time.time()
+			results.append(run(paths))
+			elapsed=time.time()-start
+			print('%-36s %7.2fs %8.1f MB/s' % (name, elapsed, total/elapsed))
+		print('Checksums match: %s' % all(result==results[0] for result in results))
+	finally:
+		shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,93 @@
+""" Local stand-in for the cutlass OSDF client, serving synthetic studies for offline runs of
+the pipeline. Put benchmarks/offline first on sys.path, before pride is imported, to use it.
+
+Studies are registered with 'register' and built with 'synthetic_study' with any fan-out of
+subjects, visits, samples, assay preps and proteomes. Every OSDF query returning the children
+of a node takes 'QUERY_LATENCY' seconds, to stand for the round trip to the OSDF server.
+"""
+import time
+
+# Seconds taken by every OSDF query.
+QUERY_LATENCY=0.0
+
+STUDIES=dict()
+
+PROTOCOL='Synthetic assay prep protocol: proteins were extracted, digested with trypsin and analysed by LC-MS/MS.'
+DATA_PROTOCOL='Synthetic data processing protocol: spectra were searched against a synthetic protein database.'
+
+def _query(children):
+	def query():
+		time.sleep(QUERY_LATENCY)
+		return iter(children)
+	return query
+
+
+class Node(object):
+	""" OSDF node with the '_' attributes cutlass gives it, and a query for each list of
+	children given by another name.
+	"""
+
+	def __init__(self, node_id, **fields):
+		self._id=node_id
+		for name, value in fields.items():
+			if name.startswith('_'):
+				setattr(self, name, value)
+			else:
+				setattr(self, name, _query(value))
+
+
+class Study(object):
+
+	@staticmethod
+	def load(study_id):
+		if study_id not in STUDIES:
+			raise Exception('No study with id '+study_id)
+		return STUDIES[study_id]
+
+
+class _OSDF(object):
+
+	def get_info(self):
+		time.sleep(QUERY_LATENCY)
+		return {'api_version': 'fake'}
+
+
+class iHMPSession(object):
+
+	def __init__(self, username, password):
+		self.username=username
+		self._osdf=_OSDF()
+
+
+def register(study):
+	STUDIES[study._id]=study
+	return study
+
+# Urls of the result, peak and raw files of a synthetic proteome on a DCC host.
+def proteome_urls(host, study_id, proteome_id):
+	base='fasp://%s/%s/%s' % (host, study_id, proteome_id)
+	return [base+'.mzid'], [base+'.mgf'], [base+'.raw']
+
+# Build a study of 'subjects' subjects with 'visits' visits each, and so on down to the
+# proteomes of every host assay prep, whose files are on the DCC 'host'.
+def synthetic_study(study_id, subjects=1, visits=1, samples=1, preps=1, proteomes=1, host='fake-dcc'):
+	def proteome(proteome_id):
+		result_urls, peak_urls, raw_urls=proteome_urls(host, study_id, proteome_id)
+		return Node(proteome_id, _result_url=result_urls, _peak_url=peak_urls, _raw_url=raw_urls, _other_url=[],
+		            _instrument_name='Synthetic Orbitrap', _exp_description='Synthetic proteome',
+		            _data_processing_protocol=DATA_PROTOCOL)
+
+	def prep(prep_id):
+		return Node(prep_id, _species='Homo sapiens', _tissue='stool', _experiment_type='Shotgun proteomics',
+		            _protocol_steps=PROTOCOL, proteomes=[proteome('%s_p%d' % (prep_id, i)) for i in range(proteomes)])
+
+	def sample(sample_id):
+		return Node(sample_id, hostAssayPreps=[prep('%s_a%d' % (sample_id, i)) for i in range(preps)], microbAssayPreps=[])
+
+	def visit(visit_id):
+		return Node(visit_id, samples=[sample('%s_s%d' % (visit_id, i)) for i in range(samples)])
+
+	def subject(subject_id):
+		return Node(subject_id, visits=[visit('%s_v%d' % (subject_id, i)) for i in range(visits)])
+
+	return register(Node(study_id, subjects=[subject('%s_j%d' % (study_id, i)) for i in range(subjects)]))
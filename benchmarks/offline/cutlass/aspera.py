@@ -0,0 +1,12 @@
+""" Local stand-in for cutlass.aspera, downloading files with the ascp found on the PATH, such
+as the one in benchmarks/bin.
+"""
+import os
+import subprocess
+
+def download_file(server, username, password, remote_path, local_path):
+	environ=os.environ.copy()
+	environ['ASPERA_SCP_PASS']=password
+	ascp_cmd=['ascp', '-QT', '-l300M', '--mode=recv', '--host='+server, '--user='+username, remote_path, local_path]
+	with open(os.devnull, 'w') as devnull:
+		return subprocess.call(ascp_cmd, stdout=devnull, stderr=devnull, env=environ) == 0
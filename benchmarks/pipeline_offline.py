@@ -0,0 +1,200 @@
+""" Run the whole pipeline offline on synthetic studies and report where the time goes.
+
+OSDF is served by the cutlass stand-in in benchmarks/offline, the DCC and PRIDE by the ascp
+stand-in in benchmarks/bin, with the given bandwidth and session latency, and the data files
+are synthetic mzIdentML, MGF and raw files of the given size. pg-converter runs in the local
+Java unless --fake-converter is given, in which case benchmarks/offline/bin/java stands for it.
+All the proteomes share the same synthetic files, so every validation is forced rather than
+taken from the validation cache.
+
+The tasks of the pipeline run one after the other in the order they are configured. The time
+of PRIDEPipeline._configure, of the tasks of the collect and submit workflows and of every
+stage recorded in the metrics of the run is reported, and appended as a JSON line to the
+--history file if given, so that runs at different scales can be compared over time.
+
+Requires anadama, which the pipeline module is built on.
+
+Usage:
+	python benchmarks/pipeline_offline.py --studies 1 --subjects 10 --proteomes 1 --fake-converter
+	python benchmarks/pipeline_offline.py --subjects 100 --visits 10 --proteomes 10 --history history.jsonl
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+OFFLINE_DIR=os.path.join(BENCHMARK_DIR, 'offline')
+sys.path.insert(0, OFFLINE_DIR)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+import cutlass
+from synthetic_data import write_proteome
+
+from pride import pipeline
+from pride.metrics import STAGES
+
+# Project metadata otherwise read from the .anadama_pride configuration file.
+PROJECT_METADATA={
+	'submitter_name': 'Offline Benchmark',
+	'submitter_email': 'benchmark@example.org',
+	'submitter_affiliation': 'Benchmark',
+	'lab_head_name': 'Offline Benchmark',
+	'lab_head_email': 'benchmark@example.org',
+	'lab_head_affiliation': 'Benchmark',
+	'submitter_pride_login': 'benchmark@example.org',
+	'project_title': 'Offline benchmark of the PRIDE submission pipeline',
+	'project_description': 'Synthetic study submitted to a local stand-in of PRIDE to measure the pipeline.',
+}
+
+# A pipeline with the given options, set up as PRIDEPipeline.__init__ would from a
+# configuration file, without checking the software or reading the configuration.
+def offline_pipeline(collect_options, submit_options):
+	pride_pipeline=pipeline.PRIDEPipeline.__new__(pipeline.PRIDEPipeline)
+	pride_pipeline.options=copy.deepcopy(pipeline.PRIDEPipeline.default_options)
+	pride_pipeline.options['collect'].update(collect_options)
+	pride_pipeline.options['submit'].update(submit_options)
+	pride_pipeline.project_metadata=copy.deepcopy(pipeline.PRIDEPipeline.project_metadata)
+	pride_pipeline.project_metadata.update(PROJECT_METADATA)
+	return pride_pipeline
+
+# Register the synthetic studies with the OSDF stand-in and place the files of all their
+# proteomes on the DCC stand-in, as links to a single set of synthetic files.
+def create_studies(args, remote_dir, data_dir):
+	template=write_proteome(data_dir, 'template', args.spectra, args.peaks, args.raw_size)
+	study_ids=list()
+	proteomes=0
+	for i in range(args.studies):
+		study_id='study%d' % i
+		study=cutlass.synthetic_study(study_id, args.subjects, args.visits, args.samples, args.preps, args.proteomes)
+		os.makedirs(os.path.join(remote_dir, study_id))
+		for subject in study.subjects():
+			for visit in subject.visits():
+				for sample in visit.samples():
+					for prep in sample.hostAssayPreps():
+						for proteome in prep.proteomes():
+							proteomes+=1
+							for path, url in zip(template, proteome._result_url+proteome._peak_url+proteome._raw_url):
+								os.symlink(path, os.path.join(remote_dir, url.split('/', 3)[3]))
+		study_ids.append(study_id)
+	return study_ids, proteomes
+
+# Run an action of a task, given as a callable or as a (callable, arguments) tuple.
+def run_action(action):
+	if callable(action):
+		return action()
+	function, arguments=action[0], action[1]
+	keywords=action[2] if len(action) > 2 else dict()
+	return function(*arguments, **keywords)
+
+# Run the tasks one after the other. Returns the seconds spent in the tasks of every
+# workflow and the name of the task that failed, if any.
+def run_tasks(tasks):
+	seconds=dict()
+	for workflow, task in tasks:
+		start=time.time()
+		try:
+			for action in task['actions'] or ():
+				if run_action(action) is False:
+					return seconds, task['name']
+		finally:
+			seconds[workflow]=seconds.get(workflow, 0)+time.time()-start
+	return seconds, None
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark the pipeline offline on synthetic studies.')
+	parser.add_argument('--studies', type=int, default=1, help='number of studies submitted in the run')
+	parser.add_argument('--subjects', type=int, default=10, help='subjects per study')
+	parser.add_argument('--visits', type=int, default=1, help='visits per subject')
+	parser.add_argument('--samples', type=int, default=1, help='samples per visit')
+	parser.add_argument('--preps', type=int, default=1, help='assay preps per sample')
+	parser.add_argument('--proteomes', type=int, default=1, help='proteomes per assay prep')
+	parser.add_argument('--spectra', type=int, default=1000, help='spectra of every result and peak file')
+	parser.add_argument('--peaks', type=int, default=100, help='peaks of every spectrum')
+	parser.add_argument('--raw-size', type=float, default=1, help='size of every raw file in MB')
+	parser.add_argument('--osdf-latency', type=float, default=0.0, help='seconds taken by every OSDF query')
+	parser.add_argument('--bandwidth', default='', help='highest rate of every ascp session, e.g. 100M')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds taken to set up every ascp session')
+	parser.add_argument('--fake-converter', action='store_true', help='validate with benchmarks/offline/bin/java')
+	parser.add_argument('--converter-rate', type=float, default=0.5, help='seconds per MB of the fake converter')
+	parser.add_argument('--streaming', action='store_true', help='upload the files of every proteome on their own')
+	parser.add_argument('-o', '--option', action='append', default=list(),
+	                    help='collect or submit option as <workflow>.<option>:<value>, e.g. collect.download_batch_size:8')
+	parser.add_argument('--history', help='JSON lines file the results are appended to')
+	parser.add_argument('--keep', action='store_true', help='keep the working directory')
+	args=parser.parse_args()
+
+	work_dir=tempfile.mkdtemp(prefix='pride_offline_')
+	remote_dir=os.path.join(work_dir, 'remote')
+	run_dir=os.path.join(work_dir, 'run')
+	for directory in (remote_dir, run_dir, os.path.join(work_dir, 'data')):
+		os.mkdir(directory)
+	paths=[os.path.join(BENCHMARK_DIR, 'bin')]
+	if args.fake_converter:
+		paths.append(os.path.join(OFFLINE_DIR, 'bin'))
+	os.environ['PATH']=os.pathsep.join(paths+[os.environ['PATH']])
+	os.environ['FAKE_ASCP_ROOT']=remote_dir
+	os.environ['FAKE_ASCP_BANDWIDTH']=args.bandwidth
+	os.environ['FAKE_ASCP_LATENCY']=str(args.latency)
+	os.environ['FAKE_CONVERTER_SECONDS_PER_MB']=str(args.converter_rate)
+	cutlass.QUERY_LATENCY=args.osdf_latency
+
+	cwd=os.getcwd()
+	try:
+		study_ids, proteomes=create_studies(args, remote_dir, os.path.join(work_dir, 'data'))
+		collect_options={'dcc_user': 'dcc', 'dcc_pw': 'dcc', 'study_id': ','.join(study_ids),
+		                 'cache_dir': os.path.join(work_dir, 'cache'), 'metrics_textfile': '', 'force_validation': True}
+		submit_options={'pride_user': 'pride', 'pride_pw': 'pride', 'pride_server': 'localhost',
+		                'pride_directory': 'pride', 'streaming': args.streaming}
+		for option in args.option:
+			name, value=option.split(':', 1)
+			workflow, name=name.split('.', 1)
+			(collect_options if workflow=='collect' else submit_options)[name]=value
+
+		os.chdir(run_dir)
+		start=time.time()
+		tasks=list()
+		for workflow in offline_pipeline(collect_options, submit_options)._configure():
+			tasks.extend((workflow.gi_code.co_name, task) for task in workflow)
+		configure_seconds=time.time()-start
+		workflow_seconds, failed=run_tasks(tasks)
+		total_seconds=time.time()-start
+
+		# The run directory is new, so every event of the metrics file is from this run.
+		stage_seconds=dict()
+		with open(os.path.join(run_dir, 'pride_metrics.jsonl')) as _file:
+			for event in map(json.loads, _file):
+				if event['event']=='stage':
+					stage_seconds[event['stage']]=stage_seconds.get(event['stage'], 0)+event['seconds']
+
+		print('')
+		print('%d studies, %d proteomes, %d tasks%s' % (len(study_ids), proteomes, len(tasks),
+		      ', task %s failed' % failed if failed else ''))
+		print('%-20s %10.2fs' % ('_configure', configure_seconds))
+		for workflow in ('collect', 'submit', 'report'):
+			print('%-20s %10.2fs' % (workflow, workflow_seconds.get(workflow, 0)))
+		print('%-20s %10.2fs' % ('total', total_seconds))
+		print('Stages:')
+		for stage in STAGES:
+			if stage in stage_seconds:
+				print('\t%-16s %10.2fs' % (stage, stage_seconds[stage]))
+
+		if args.history:
+			with open(os.path.join(cwd, args.history), 'a') as history:
+				history.write(json.dumps({'time': time.time(), 'arguments': vars(args), 'proteomes': proteomes,
+				                          'tasks': len(tasks), 'failed': failed, 'configure': configure_seconds,
+				                          'workflows': workflow_seconds, 'stages': stage_seconds,
+				                          'total': total_seconds}, sort_keys=True)+'\n')
+	finally:
+		os.chdir(cwd)
+		if args.keep:
+			print('Working directory kept in '+work_dir)
+		else:
+			shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
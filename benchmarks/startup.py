@@ -0,0 +1,106 @@
+""" Measure how long the pipeline takes to start: to load the plugin module as anadama does
+when it lists its pipelines, to construct PRIDEPipeline as 'anadama help pipeline pride'
+does, and to check the software the stages run, the first time and once the checks are
+cached. Every measure runs in a new interpreter, with a configuration file in a temporary
+home directory and the ascp and java stand-ins of benchmarks/bin and benchmarks/offline/bin
+on the PATH. The anadama help and listing commands are timed too when anadama is installed.
+
+Requires anadama, which the pipeline module is built on.
+
+Usage:
+	python benchmarks/startup.py -n 10
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR=os.path.join(BENCHMARK_DIR, '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from pride.software import find_binary
+
+CONFIG='''dcc_user=dcc
+dcc_pw=dcc
+pride_user=pride
+pride_pw=pride
+pride_server=localhost
+pride_directory=pride
+submitter_name=Startup Benchmark
+submitter_email=benchmark@example.org
+submitter_affiliation=Benchmark
+lab_head_name=Startup Benchmark
+lab_head_email=benchmark@example.org
+lab_head_affiliation=Benchmark
+submitter_pride_login=benchmark@example.org
+project_title=Startup benchmark of the PRIDE submission pipeline
+project_description=Configuration of the startup benchmark of the PRIDE submission pipeline.
+'''
+
+# Python code of every measure, run in a new interpreter after the startup of the interpreter
+# itself is timed. The code prints whether cutlass was imported.
+MEASURES=[
+	('plugin load', 'import pride.pipeline'),
+	('construction', 'import pride.pipeline; pride.pipeline.PRIDEPipeline()'),
+	('software check', 'from pride.software import check_software_dependencies; '
+	                   'check_software_dependencies(probe_path=%(probe_path)r)'),
+]
+
+# Seconds taken by the command, the median of 'runs' runs, and its output of the last run.
+def time_command(command, environ, runs):
+	seconds=list()
+	for run in range(runs):
+		start=time.time()
+		process=subprocess.Popen(command, env=environ, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		output=process.communicate()[0]
+		seconds.append(time.time()-start)
+	return sorted(seconds)[len(seconds) // 2], output
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark the startup of the pipeline.')
+	parser.add_argument('-n', '--runs', type=int, default=5, help='runs of every measure, the median is reported')
+	args=parser.parse_args()
+
+	home_dir=tempfile.mkdtemp(prefix='pride_startup_')
+	try:
+		with open(os.path.join(home_dir, '.anadama_pride'), 'w') as config:
+			config.write(CONFIG)
+		probe_path=os.path.join(home_dir, 'software.json')
+		environ=os.environ.copy()
+		environ['HOME']=home_dir
+		environ['PATH']=os.pathsep.join([os.path.join(BENCHMARK_DIR, 'bin'), os.path.join(BENCHMARK_DIR, 'offline', 'bin'),
+		                                 environ['PATH']])
+		environ['PYTHONPATH']=os.pathsep.join([os.path.abspath(PACKAGE_DIR)]+
+		                                      [path for path in [environ.get('PYTHONPATH')] if path])
+
+		interpreter, output=time_command([sys.executable, '-c', 'pass'], environ, args.runs)
+		print('%-32s %8.3fs' % ('interpreter', interpreter))
+		for name, code in MEASURES:
+			code=code % {'probe_path': probe_path}+"; import sys; print('cutlass imported: %s' % ('cutlass' in sys.modules))"
+			if name=='software check':
+				# The first run probes the binaries and caches the results for the other runs.
+				if os.path.exists(probe_path):
+					os.remove(probe_path)
+				cold, output=time_command([sys.executable, '-c', code], environ, 1)
+				print('%-32s %8.3fs %8.3fs over the interpreter' % (name+' (first)', cold, cold-interpreter))
+				name=name+' (cached)'
+			seconds, output=time_command([sys.executable, '-c', code], environ, args.runs)
+			print('%-32s %8.3fs %8.3fs over the interpreter  %s' % (name, seconds, seconds-interpreter,
+			      output.strip().splitlines()[-1] if output.strip() else ''))
+
+		anadama=find_binary('anadama')
+		if anadama is None:
+			print('anadama is not on the PATH, its help and listing commands are not timed')
+			return
+		for command in (['help', 'pipeline', 'pride'], ['help', 'pipeline']):
+			seconds, output=time_command([anadama]+command, environ, args.runs)
+			print('%-32s %8.3fs' % ('anadama '+' '.join(command), seconds))
+	finally:
+		shutil.rmtree(home_dir)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,135 @@
+""" Compare the time taken to write submission.px by the original writer, which scans the
+whole file mapping list for every result file, and by the Submission model, and check that
+both produce byte-identical files.
+
+Usage:
+	python benchmarks/submission_writer.py -r 2000 -f 50
+"""
+import os
+import sys
+import time
+import shutil
+import filecmp
+import argparse
+import tempfile
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pride.submission import Submission
+
+# The submission.px writer as it was before the Submission model, working on the parallel
+# lists of the module level file_mapping and sample_metadata dictionaries.
+def legacy_write(submission_file_name, project_metadata, file_mapping, sample_metadata):
+	def fill_list_type_metadata(submission_file,data):
+		data_string='['
+		for item in data:
+			data_string += str(item)
+		data_string += ']'
+		submission_file.write(data_string)
+
+	submission_file = open(submission_file_name, "a+")
+	for entry in project_metadata:
+		data = project_metadata[entry]
+		if (type(data) is str):
+			submission_file.write('MTD\t' + entry + '\t' + project_metadata[entry] + '\n')
+		else:
+			data_string = 'MTD\t' + entry + '\t['
+			for item in data:
+				data_string += str(item)
+			data_string += ']\n'
+			submission_file.write(data_string)
+
+	submission_file.write('\nFMH\t')
+	for entry in file_mapping:
+		submission_file.write(entry+'\t')
+	submission_file.write('\n')
+
+	for id in file_mapping["file_id"]:
+		submission_file.write('FME\t'+str(id)+'\t'+file_mapping["file_type"][id-1]+'\t'+file_mapping["file_path"][id-1]+'\t')
+		if(file_mapping["file_type"][id-1]=="result"):
+			for mapping in file_mapping["file_mapping"]:
+				splits=mapping.split(':')
+				if splits[0]==str(id):
+					submission_file.write(splits[1]+',')
+		submission_file.write('\n')
+
+	submission_file.write('\nSMH\t')
+	for entry in sample_metadata:
+		submission_file.write(entry + '\t')
+	submission_file.write('\n')
+
+	for id in range(len(sample_metadata["file_id"])):
+		submission_file.write('SME\t')
+		submission_file.write(str(sample_metadata["file_id"][id])+'\t')
+		fill_list_type_metadata(submission_file,sample_metadata["species"][id])
+		submission_file.write('\t')
+		fill_list_type_metadata(submission_file, sample_metadata["tissue"][id])
+		submission_file.write('\t')
+		fill_list_type_metadata(submission_file, sample_metadata["instrument"][id])
+		submission_file.write('\t')
+		submission_file.write(sample_metadata["experimental_factor"][id])
+		submission_file.write('\n')
+	submission_file.close()
+
+# Build the same synthetic study in both representations: 'results' proteomes with a result,
+# a peak and 'raw_files' raw files each.
+def synthetic_study(results, raw_files):
+	file_mapping=OrderedDict([("file_id", list()), ("file_type", list()), ("file_path", list()), ("file_mapping", list())])
+	sample_metadata=OrderedDict([("file_id", list()), ("species", list()), ("tissue", list()),
+	                             ("instrument", list()), ("experimental_factor", list())])
+	submission=Submission()
+
+	def add_file(file_type, file_path, result_id=0):
+		id = len(file_mapping["file_id"]) + 1
+		file_mapping["file_id"].append(id)
+		file_mapping["file_type"].append(file_type)
+		file_mapping["file_path"].append(file_path)
+		if(file_type=="raw"):
+			file_mapping["file_mapping"].append(str(result_id)+':'+str(id))
+		submission.add_file(file_type, file_path, result_id)
+		return id
+
+	for result in range(results):
+		result_id=add_file('result', '/data/study/result_%d.mzid' % result)
+		sample=('Homo sapiens', 'feces', 'Q Exactive', 'proteome %d' % result)
+		for key, value in zip(list(sample_metadata)[1:], sample):
+			sample_metadata[key].append(value)
+		sample_metadata["file_id"].append(result_id)
+		submission.add_sample(result_id, *sample)
+		add_file('peak', '/data/study/peak_%d.mgf' % result)
+		for raw in range(raw_files):
+			add_file('raw', '/data/study/raw_%d_%d.raw' % (result, raw), result_id)
+
+	project_metadata=OrderedDict([("submitter_name", 'Submitter'), ("project_title", 'Synthetic study'),
+	                              ("submission_type", 'COMPLETE'), ("species", ['Homo sapiens']),
+	                              ("instrument", ['Q Exactive'])])
+	return project_metadata, file_mapping, sample_metadata, submission
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark the submission.px writers.')
+	parser.add_argument('-r', '--results', type=int, default=2000, help='number of result files')
+	parser.add_argument('-f', '--raw-files', type=int, default=50, help='number of raw files per result')
+	args=parser.parse_args()
+
+	project_metadata, file_mapping, sample_metadata, submission=synthetic_study(args.results, args.raw_files)
+	print('%d files, %d results' % (len(submission.files), args.results))
+
+	work_dir=tempfile.mkdtemp()
+	try:
+		legacy_path=os.path.join(work_dir, 'legacy.px')
+		start=time.time()
+		legacy_write(legacy_path, project_metadata, file_mapping, sample_metadata)
+		print('legacy writer     %9.2fs' % (time.time()-start))
+
+		model_path=os.path.join(work_dir, 'submission.px')
+		start=time.time()
+		submission.write(model_path, project_metadata)
+		print('submission model  %9.2fs' % (time.time()-start))
+
+		print('byte-identical: %s' % filecmp.cmp(legacy_path, model_path, shallow=False))
+	finally:
+		shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
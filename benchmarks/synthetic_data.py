@@ -0,0 +1,165 @@
+""" Write synthetic proteomics data for offline runs of the pipeline: an mzIdentML result file
+identifying every spectrum of an MGF peak file, and a raw file of random bytes. The files
+pass the checks of pride/precheck.py and their size is set by the number of spectra, the
+number of peaks per spectrum and the size of the raw file.
+
+Usage:
+	python benchmarks/synthetic_data.py out_dir --spectra 5000 --peaks 100 --raw-size 50
+"""
+import os
+import random
+import argparse
+
+MB=1024*1024
+AMINO_ACIDS='ACDEFGHIKLMNPQRSTVWY'
+PROTON=1.007276
+
+# Monoisotopic residue masses, for peptide precursor masses that look plausible.
+RESIDUE_MASSES=dict(zip(AMINO_ACIDS, (71.03711, 103.00919, 115.02694, 129.04259, 147.06841, 57.02146, 137.05891,
+                                      113.08406, 128.09496, 113.08406, 131.04049, 114.04293, 97.05276, 128.05858,
+                                      156.10111, 87.03203, 101.04768, 99.06841, 186.07931, 163.06333)))
+
+MZID_HEADER='''<?xml version="1.0" encoding="UTF-8"?>
+<MzIdentML id="synthetic" version="1.1.0" xmlns="http://psidev.info/psi/pi/mzIdentML/1.1"
+           xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+           xsi:schemaLocation="http://psidev.info/psi/pi/mzIdentML/1.1 http://www.psidev.info/files/mzIdentML1.1.0.xsd"
+           creationDate="2016-01-01T00:00:00">
+  <cvList>
+    <cv id="PSI-MS" fullName="PSI-MS" uri="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo" version="3.30.0"/>
+    <cv id="UO" fullName="UNIT-ONTOLOGY" uri="http://obo.cvs.sourceforge.net/*checkout*/obo/obo/ontology/phenotype/unit.obo"/>
+  </cvList>
+  <AnalysisSoftwareList>
+    <AnalysisSoftware id="synthetic_software" name="synthetic_data.py" version="1.0">
+      <SoftwareName><cvParam accession="MS:1001456" cvRef="PSI-MS" name="analysis software"/></SoftwareName>
+    </AnalysisSoftware>
+  </AnalysisSoftwareList>
+  <SequenceCollection>
+'''
+
+MZID_ANALYSIS='''  </SequenceCollection>
+  <AnalysisCollection>
+    <SpectrumIdentification id="SI" spectrumIdentificationProtocol_ref="SIP" spectrumIdentificationList_ref="SIL">
+      <InputSpectra spectraData_ref="SD"/>
+      <SearchDatabaseRef searchDatabase_ref="SDB"/>
+    </SpectrumIdentification>
+  </AnalysisCollection>
+  <AnalysisProtocolCollection>
+    <SpectrumIdentificationProtocol id="SIP" analysisSoftware_ref="synthetic_software">
+      <SearchType><cvParam accession="MS:1001083" cvRef="PSI-MS" name="ms-ms search"/></SearchType>
+      <Threshold><cvParam accession="MS:1001494" cvRef="PSI-MS" name="no threshold"/></Threshold>
+    </SpectrumIdentificationProtocol>
+  </AnalysisProtocolCollection>
+  <DataCollection>
+    <Inputs>
+      <SearchDatabase id="SDB" location="synthetic.fasta">
+        <FileFormat><cvParam accession="MS:1001348" cvRef="PSI-MS" name="FASTA format"/></FileFormat>
+        <DatabaseName><userParam name="synthetic.fasta"/></DatabaseName>
+      </SearchDatabase>
+      <SpectraData id="SD" location="%(peak_name)s" name="%(peak_name)s">
+        <FileFormat><cvParam accession="MS:1001062" cvRef="PSI-MS" name="Mascot MGF format"/></FileFormat>
+        <SpectrumIDFormat><cvParam accession="MS:1000774" cvRef="PSI-MS" name="multiple peak list nativeID format"/></SpectrumIDFormat>
+      </SpectraData>
+    </Inputs>
+    <AnalysisData>
+      <SpectrumIdentificationList id="SIL">
+'''
+
+MZID_FOOTER='''      </SpectrumIdentificationList>
+    </AnalysisData>
+  </DataCollection>
+</MzIdentML>
+'''
+
+def peptide_mass(sequence):
+	return sum(RESIDUE_MASSES[residue] for residue in sequence)+18.01056
+
+def random_sequence(generator, length):
+	return ''.join(generator.choice(AMINO_ACIDS) for i in range(length))
+
+# Peptides identified by the result file and the precursor m/z of their spectra: one peptide
+# for about every two spectra, each taken from one of about half as many proteins.
+def synthetic_peptides(spectra, seed=0):
+	generator=random.Random(seed)
+	proteins=[random_sequence(generator, generator.randint(200, 600)) for i in range(max(1, spectra // 4))]
+	peptides=list()
+	for i in range(max(1, spectra // 2)):
+		protein=generator.randrange(len(proteins))
+		length=generator.randint(7, 20)
+		start=generator.randrange(len(proteins[protein])-length)
+		peptides.append((protein, start, proteins[protein][start:start+length]))
+	return proteins, peptides
+
+# Write an mzIdentML result file identifying the 'spectra' spectra of the MGF file 'peak_name'
+# by their index in that file.
+def write_mzid(path, spectra, peak_name, seed=0):
+	proteins, peptides=synthetic_peptides(spectra, seed)
+	with open(path, 'w') as _file:
+		_file.write(MZID_HEADER)
+		for i, sequence in enumerate(proteins):
+			_file.write('    <DBSequence id="DBSeq_%d" accession="SYN%06d" searchDatabase_ref="SDB" length="%d">'
+			            '<Seq>%s</Seq></DBSequence>\n' % (i, i, len(sequence), sequence))
+		for i, (protein, start, sequence) in enumerate(peptides):
+			_file.write('    <Peptide id="Pep_%d"><PeptideSequence>%s</PeptideSequence></Peptide>\n' % (i, sequence))
+		for i, (protein, start, sequence) in enumerate(peptides):
+			_file.write('    <PeptideEvidence id="PE_%d" peptide_ref="Pep_%d" dBSequence_ref="DBSeq_%d" start="%d" end="%d" '
+			            'isDecoy="false"/>\n' % (i, i, protein, start+1, start+len(sequence)))
+		_file.write(MZID_ANALYSIS % {'peak_name': peak_name})
+		for i in range(spectra):
+			peptide=i % len(peptides)
+			mz=(peptide_mass(peptides[peptide][2])+2*PROTON)/2
+			_file.write('        <SpectrumIdentificationResult id="SIR_%d" spectrumID="index=%d" spectraData_ref="SD">\n'
+			            '          <SpectrumIdentificationItem id="SII_%d" chargeState="2" experimentalMassToCharge="%.4f" '
+			            'calculatedMassToCharge="%.4f" peptide_ref="Pep_%d" rank="1" passThreshold="true">'
+			            '<PeptideEvidenceRef peptideEvidence_ref="PE_%d"/></SpectrumIdentificationItem>\n'
+			            '          <cvParam accession="MS:1000796" cvRef="PSI-MS" name="spectrum title" value="spectrum_%d"/>\n'
+			            '        </SpectrumIdentificationResult>\n' % (i, i, i, mz, mz, peptide, peptide, i))
+		_file.write(MZID_FOOTER)
+
+# Write an MGF peak file of 'spectra' spectra of 'peaks' peaks each, matching the precursors
+# of the result file written by write_mzid with the same seed.
+def write_mgf(path, spectra, peaks=100, seed=0):
+	proteins, peptides=synthetic_peptides(spectra, seed)
+	generator=random.Random(seed)
+	with open(path, 'w') as _file:
+		for i in range(spectra):
+			mz=(peptide_mass(peptides[i % len(peptides)][2])+2*PROTON)/2
+			lines=['BEGIN IONS', 'TITLE=spectrum_%d' % i, 'PEPMASS=%.4f' % mz, 'CHARGE=2+', 'RTINSECONDS=%.1f' % (i*0.5)]
+			masses=sorted(generator.uniform(100, 2*mz) for peak in range(peaks))
+			lines.extend('%.4f %.1f' % (mass, generator.uniform(10, 10000)) for mass in masses)
+			lines.append('END IONS\n')
+			_file.write('\n'.join(lines)+'\n')
+
+# Write a raw file of 'size' MB of random bytes, which do not compress.
+def write_raw(path, size):
+	with open(path, 'wb') as _file:
+		for block in range(int(size*MB) // MB):
+			_file.write(os.urandom(MB))
+		_file.write(os.urandom(int(size*MB) % MB))
+
+# Write a result, peak and raw file named after 'name' into 'directory'. Returns their paths.
+def write_proteome(directory, name, spectra, peaks=100, raw_size=1, seed=0):
+	result_path=os.path.join(directory, name+'.mzid')
+	peak_path=os.path.join(directory, name+'.mgf')
+	raw_path=os.path.join(directory, name+'.raw')
+	write_mzid(result_path, spectra, os.path.basename(peak_path), seed)
+	write_mgf(peak_path, spectra, peaks, seed)
+	write_raw(raw_path, raw_size)
+	return result_path, peak_path, raw_path
+
+def main():
+	parser=argparse.ArgumentParser(description='Write synthetic mzIdentML, MGF and raw files.')
+	parser.add_argument('directory', help='directory to write the files to')
+	parser.add_argument('--name', default='synthetic', help='name of the files, without extension')
+	parser.add_argument('--spectra', type=int, default=1000, help='number of spectra')
+	parser.add_argument('--peaks', type=int, default=100, help='number of peaks per spectrum')
+	parser.add_argument('--raw-size', type=float, default=1, help='size of the raw file in MB')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the random content')
+	args=parser.parse_args()
+
+	if not os.path.isdir(args.directory):
+		os.makedirs(args.directory)
+	for path in write_proteome(args.directory, args.name, args.spectra, args.peaks, args.raw_size, args.seed):
+		print('%-40s %10.2f MB' % (path, os.path.getsize(path) / float(MB)))
+
+if __name__ == '__main__':
+	main()
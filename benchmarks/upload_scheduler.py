@@ -0,0 +1,61 @@
+""" Run the sharded upload scheduler offline against the fake ascp in benchmarks/bin, with a
+mix of many small and a few large files, and check that every file arrives.
+
+Usage:
+	python benchmarks/upload_scheduler.py --sessions 4 --bandwidth 200M --fail-rate 0.1
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+from pride.upload import UploadScheduler
+
+def create_files(directory, small, large, small_size, large_size):
+	paths=list()
+	for i in range(small):
+		paths.append(os.path.join(directory, 'other_%d.txt' % i))
+		with open(paths[-1], 'wb') as _file:
+			_file.write(os.urandom(small_size))
+	for i in range(large):
+		paths.append(os.path.join(directory, 'raw_%d.raw' % i))
+		with open(paths[-1], 'wb') as _file:
+			_file.write(os.urandom(large_size))
+	return paths
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark the sharded ascp upload scheduler.')
+	parser.add_argument('--sessions', type=int, default=4, help='concurrent ascp sessions')
+	parser.add_argument('--bandwidth', default='200M', help='aggregate transfer rate')
+	parser.add_argument('--retries', type=int, default=2, help='retries of failed files')
+	parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of a file transfer failing')
+	parser.add_argument('--small', type=int, default=200, help='number of small files')
+	parser.add_argument('--large', type=int, default=4, help='number of large files')
+	args=parser.parse_args()
+
+	work_dir=tempfile.mkdtemp()
+	os.environ['PATH']=os.path.join(BENCHMARK_DIR, 'bin')+os.pathsep+os.environ['PATH']
+	os.environ['FAKE_ASCP_ROOT']=os.path.join(work_dir, 'remote')
+	os.environ['FAKE_ASCP_FAIL_RATE']=str(args.fail_rate)
+	try:
+		local_dir=os.path.join(work_dir, 'study')
+		os.mkdir(local_dir)
+		paths=create_files(local_dir, args.small, args.large, 64*1024, 16*1024*1024)
+
+		scheduler=UploadScheduler('user@localhost:/pride/study', 'password', args.sessions, args.bandwidth, args.retries)
+		start=time.time()
+		failed=scheduler.upload(paths)
+		elapsed=time.time()-start
+
+		arrived=os.listdir(os.path.join(work_dir, 'remote', 'pride', 'study'))
+		print('%d files in %d sessions: %.2fs, %d failed, %d arrived' % (len(paths), args.sessions, elapsed, len(failed), len(arrived)))
+	finally:
+		shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
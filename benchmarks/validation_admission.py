@@ -0,0 +1,80 @@
+""" Validate a small proteome, then a large one and the small one again through a
+ValidationScheduler sharing its memory budget through a slot folder, as a job process of the
+pipeline does, with the java stand-in of benchmarks/offline/bin. The heap history is seeded so
+that the large proteome needs more than the validator service started for the small one and
+more than what that service leaves of the budget, and every validation must be admitted
+within the timeout.
+
+Usage:
+	python benchmarks/validation_admission.py --budget 4000 --timeout 60
+"""
+import os
+import sys
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+from synthetic_data import write_proteome
+from pride.validation import (Converter, HeapHistory, ValidationScheduler, converter_arguments, MB, MIN_HEAP,
+                              HEAP_MARGIN)
+
+class AdmissionTimeout(Exception):
+	pass
+
+def input_mb(result_path, peak_path):
+	return (os.path.getsize(result_path) + os.path.getsize(peak_path)) / float(MB)
+
+def main():
+	parser=argparse.ArgumentParser(description='Check the admission of a large validation after a small one.')
+	parser.add_argument('--budget', type=int, default=4000, help='memory budget in MB')
+	parser.add_argument('--small-spectra', type=int, default=200, help='spectra of the small proteome')
+	parser.add_argument('--large-spectra', type=int, default=2000, help='spectra of the large proteome')
+	parser.add_argument('--converter-rate', type=float, default=0.05, help='seconds per MB of the fake converter')
+	parser.add_argument('--timeout', type=int, default=60, help='seconds every validation must complete in')
+	args=parser.parse_args()
+
+	work_dir=tempfile.mkdtemp()
+	os.environ['PATH']=os.path.join(BENCHMARK_DIR, 'offline', 'bin')+os.pathsep+os.environ['PATH']
+	os.environ['FAKE_CONVERTER_SECONDS_PER_MB']=str(args.converter_rate)
+	def timeout(signum, frame):
+		raise AdmissionTimeout()
+	signal.signal(signal.SIGALRM, timeout)
+	try:
+		small=write_proteome(work_dir, 'small', args.small_spectra, raw_size=0)[:2]
+		large=write_proteome(work_dir, 'large', args.large_spectra, raw_size=0, seed=1)[:2]
+
+		# Two runs fitting the small proteome to the smallest heap and the large one to three
+		# quarters of the budget.
+		history=HeapHistory()
+		history.record(input_mb(*small), MIN_HEAP, MIN_HEAP / HEAP_MARGIN)
+		history.record(input_mb(*large), args.budget, 0.75 * args.budget / HEAP_MARGIN)
+
+		scheduler=ValidationScheduler(Converter('service', start=False), 1, args.budget, history,
+		                              os.path.join(work_dir, 'slots'))
+		for name, (result_path, peak_path) in (('small', small), ('large', large), ('small', small)):
+			heap=scheduler.estimate(result_path, peak_path)
+			start=time.time()
+			signal.alarm(args.timeout)
+			try:
+				peak_mb=scheduler.run(converter_arguments(result_path, peak_path, os.path.join(work_dir, 'report.txt')),
+				                      result_path, peak_path)
+			except AdmissionTimeout:
+				print('%-5s %5d MB heap: not done within %d seconds' % (name, heap, args.timeout))
+				sys.exit(1)
+			finally:
+				signal.alarm(0)
+			# Services are only started before a validation, so one serving the heap now ran it.
+			print('%-5s %5d MB heap: %7.2fs in %s, %s MB peak' % (name, heap, time.time()-start,
+			      'the validator service' if scheduler.converter.serves(heap) else 'its own JVM',
+			      '?' if peak_mb is None else '%.1f' % peak_mb))
+		scheduler.close()
+	finally:
+		shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
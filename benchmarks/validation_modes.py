@@ -0,0 +1,43 @@
+""" Compare the total pg-converter validation wall time of N proteomes when every
+validation starts a new JVM ('process' mode) and when a single validator service JVM
+is reused for all of them ('service' mode).
+
+Usage:
+	python benchmarks/validation_modes.py result.mzid peak.mgf -n 20
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pride.validation import Converter, converter_arguments
+
+def run_mode(mode, result_path, peak_path, count, work_dir):
+	start=time.time()
+	converter=Converter(mode)
+	for i in range(count):
+		converter.run(converter_arguments(result_path, peak_path, os.path.join(work_dir, '%s_%d.txt' % (mode, i))))
+	converter.close()
+	return time.time()-start
+
+def main():
+	parser=argparse.ArgumentParser(description='Benchmark pg-converter validation modes.')
+	parser.add_argument('result', help='mzIdentML result file')
+	parser.add_argument('peak', help='MGF peak file')
+	parser.add_argument('-n', '--proteomes', type=int, default=10, help='number of validations per mode')
+	args=parser.parse_args()
+
+	work_dir=tempfile.mkdtemp()
+	try:
+		for mode in ('process', 'service'):
+			elapsed=run_mode(mode, os.path.abspath(args.result), os.path.abspath(args.peak), args.proteomes, work_dir)
+			print('%-8s %4d validations %9.2fs total %7.2fs per proteome' % (mode, args.proteomes, elapsed, elapsed/args.proteomes))
+	finally:
+		shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,114 @@
+import os
+import time
+import errno
+import shutil
+import sqlite3
+import threading
+import subprocess
+
+from .checksum import file_checksum
+
+# Place a copy of 'source' at 'target' without duplicating the data when possible: as a hard
+# link, else as a reflink (copy-on-write clone) and only as a last resort as a full copy.
+def link_file(source, target):
+	try:
+		os.link(source, target)
+		return
+	except OSError:
+		pass
+	with open(os.devnull, 'w') as devnull:
+		if subprocess.call(['cp', '--reflink=always', source, target], stdout=devnull, stderr=devnull) == 0:
+			return
+	shutil.copyfile(source, target)
+
+
+class DownloadCache(object):
+	""" Persistent, content addressed cache of the files downloaded from the DCC.
+
+	Every downloaded file is stored once under its MD5 checksum, whichever urls, proteomes or
+	studies it is referenced from. The url index records the size and checksum of the content
+	last downloaded from each url; it cannot tell whether that url still serves the same
+	content, so the DownloadPool compares every copy it fetches with the file at the DCC before
+	using it. Files are materialised into the result folder as links to the cached objects, and
+	the least recently used objects are evicted once the cache grows beyond 'max_size' bytes.
+	"""
+
+	def __init__(self, cache_dir, max_size):
+		self.cache_dir=cache_dir
+		self.max_size=max_size
+		self._lock=threading.Lock()
+
+		if not os.path.exists(os.path.join(cache_dir, 'objects')):
+			os.makedirs(os.path.join(cache_dir, 'objects'))
+		self._db=sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, checksum TEXT, size INTEGER)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS objects (checksum TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+
+	def _object_path(self, checksum):
+		return os.path.join(self.cache_dir, 'objects', checksum[:2], checksum)
+
+	# Materialise the content last downloaded from 'url' at 'target'. Returns False if the url is
+	# not cached or its object is missing or truncated.
+	def fetch(self, url, target):
+		with self._lock:
+			row=self._db.execute('SELECT checksum, size FROM urls WHERE url=?', (url,)).fetchone()
+			if row is None:
+				return False
+			checksum, size=row
+			path=self._object_path(checksum)
+			if not os.path.exists(path) or os.path.getsize(path) != size:
+				with self._db:
+					self._db.execute('DELETE FROM urls WHERE url=?', (url,))
+				return False
+			link_file(path, target)
+			with self._db:
+				self._db.execute('UPDATE objects SET last_used=? WHERE checksum=?', (time.time(), checksum))
+		return True
+
+	# Sizes of the content last seen at every cached url, by url.
+	def sizes(self):
+		with self._lock:
+			return dict(self._db.execute('SELECT url, size FROM urls').fetchall())
+
+	# Add the file downloaded from 'url' to the cache.
+	def store(self, url, path, checksum=None):
+		if checksum is None:
+			checksum=file_checksum(path)
+		size=os.path.getsize(path)
+		object_path=self._object_path(checksum)
+		with self._lock:
+			if not os.path.exists(object_path):
+				try:
+					os.makedirs(os.path.dirname(object_path))
+				except OSError as e:
+					if e.errno != errno.EEXIST:
+						raise
+				link_file(path, object_path)
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?)', (url, checksum, size))
+				self._db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)', (checksum, size, time.time()))
+			self._evict(keep=checksum)
+		return checksum
+
+	# Remove the least recently used objects until the cache fits its size cap again.
+	def _evict(self, keep):
+		total=self._db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+		if total <= self.max_size:
+			return
+		rows=self._db.execute('SELECT checksum, size FROM objects WHERE checksum != ? ORDER BY last_used', (keep,)).fetchall()
+		with self._db:
+			for checksum, size in rows:
+				if total <= self.max_size:
+					break
+				try:
+					os.remove(self._object_path(checksum))
+				except OSError:
+					pass
+				self._db.execute('DELETE FROM objects WHERE checksum=?', (checksum,))
+				self._db.execute('DELETE FROM urls WHERE checksum=?', (checksum,))
+				total-=size
+
+	def close(self):
+		with self._lock:
+			self._db.close()
@@ -0,0 +1,55 @@
+import os
+import mmap
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+# Size of the blocks of a file handed to the hash functions at once.
+BLOCK_SIZE=8*1024*1024
+
+# Name of the checksum manifest uploaded to PRIDE along with submission.px.
+MANIFEST_NAME='checksum.txt'
+
+# MD5 and SHA-1 checksums of the content of a file, computed in a single pass over a memory
+# map of the file. The hash functions release the GIL on every block, so the checksums of
+# several files can be computed at once by threads.
+def file_checksums(path):
+	md5=hashlib.md5()
+	sha1=hashlib.sha1()
+	with open(path, 'rb') as _file:
+		size=os.fstat(_file.fileno()).st_size
+		if size:
+			data=mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				for offset in range(0, size, BLOCK_SIZE):
+					block=buffer(data, offset, BLOCK_SIZE)
+					md5.update(block)
+					sha1.update(block)
+			finally:
+				data.close()
+	return md5.hexdigest(), sha1.hexdigest()
+
+# MD5 checksum of the content of a file.
+def file_checksum(path):
+	return file_checksums(path)[0]
+
+# MD5 and SHA-1 checksums of several files, computed by 'workers' threads. Returns a dict of
+# the checksums of every path.
+def checksum_files(paths, workers=4):
+	paths=list(paths)
+	if not paths:
+		return dict()
+	pool=ThreadPool(max(1, min(int(workers), len(paths))))
+	try:
+		return dict(zip(paths, pool.map(file_checksums, paths)))
+	finally:
+		pool.close()
+		pool.join()
+
+# Write the checksum manifest PRIDE expects with the submitted files: the name and SHA-1
+# checksum of every file, one per line. 'checksums' maps file names to their MD5 and SHA-1
+# checksums.
+def write_manifest(path, checksums):
+	with open(path, 'w') as manifest:
+		manifest.write('# SHA-1 Checksum\n')
+		for file_name in sorted(checksums):
+			manifest.write(file_name+'\t'+checksums[file_name][1]+'\n')
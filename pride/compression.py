@@ -0,0 +1,81 @@
+import os
+import zlib
+import struct
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+# Size of the blocks of a file compressed independently of each other.
+BLOCK_SIZE=4*1024*1024
+COMPRESSION_LEVEL=6
+
+# Blocks sampled across a file to measure how well it compresses, and their size.
+SAMPLE_BLOCKS=8
+SAMPLE_SIZE=256*1024
+
+# Header of a gzip member without a file name or modification time.
+GZIP_HEADER='\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+# Extension of the compressed copy of a file.
+GZIP_EXTENSION='.gz'
+
+# Size of the compressed data over the size of the data, measured on blocks sampled evenly
+# across the file with a fast compression level. Already compressed and binary vendor files
+# come close to 1, text such as mzIdentML and MGF files well below.
+def compression_ratio(path):
+	size=os.path.getsize(path)
+	if size==0:
+		return 1.0
+	step=max(SAMPLE_SIZE, size // SAMPLE_BLOCKS)
+	sampled=0
+	compressed=0
+	with open(path, 'rb') as _file:
+		for offset in range(0, size, step):
+			_file.seek(offset)
+			block=_file.read(SAMPLE_SIZE)
+			sampled+=len(block)
+			compressed+=len(zlib.compress(block, 1))
+	return compressed / float(sampled)
+
+# Compress a block of data into a complete gzip member.
+def _gzip_member(block):
+	compressor=zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+	data=compressor.compress(block)+compressor.flush()
+	return GZIP_HEADER+data+struct.pack('<II', zlib.crc32(block) & 0xffffffff, len(block) & 0xffffffff)
+
+def _read_blocks(_file, count):
+	blocks=list()
+	for i in range(count):
+		block=_file.read(BLOCK_SIZE)
+		if not block:
+			break
+		blocks.append(block)
+	return blocks
+
+# Compress a file into 'target' with 'workers' threads, one per CPU if 0, each compressing
+# a different block of the file at once. Every block is written as a gzip member of its own;
+# gunzip and the gzip module read such a file as one stream. Returns the MD5 and SHA-1
+# checksums of the compressed file, computed while it is written.
+def gzip_file(source, target, workers=0):
+	workers=int(workers) or multiprocessing.cpu_count()
+	md5=hashlib.md5()
+	sha1=hashlib.sha1()
+	pool=ThreadPool(workers)
+	partial_target=target+'.part'
+	try:
+		with open(source, 'rb') as _input, open(partial_target, 'wb') as _output:
+			# Only a few blocks per worker are read ahead, whatever the size of the file.
+			blocks=_read_blocks(_input, 2*workers)
+			while blocks:
+				for member in pool.map(_gzip_member, blocks):
+					md5.update(member)
+					sha1.update(member)
+					_output.write(member)
+				blocks=_read_blocks(_input, 2*workers)
+		os.rename(partial_target, target)
+	finally:
+		pool.close()
+		pool.join()
+		if os.path.exists(partial_target):
+			os.remove(partial_target)
+	return md5.hexdigest(), sha1.hexdigest()
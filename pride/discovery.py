@@ -0,0 +1,80 @@
+import time
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+from . import PrepProt
+
+# Wrap an OSDF query of a node so that every call is timed and recorded in 'metrics', if
+# given, as an 'osdf_query' event.
+def timed_query(name, query, metrics=None):
+	if metrics is None:
+		return lambda node: list(query(node))
+	def run(node):
+		with metrics.timer('osdf_query', query=name, node=getattr(node, '_id', None)) as event:
+			results=list(query(node))
+			event['results']=len(results)
+		return results
+	return run
+
+# Retrieve each proteome derived from either a host assay prep or a micrebiome assay prep
+# prepared form each sample collected during each visit by each subject that participated
+# in the given study, one OSDF query after the other.
+def discover_serial(study, metrics=None):
+	subjects=timed_query('subjects', lambda study: study.subjects(), metrics)
+	visits=timed_query('visits', lambda subject: subject.visits(), metrics)
+	samples=timed_query('samples', lambda visit: visit.samples(), metrics)
+	host_preps=timed_query('host_assay_preps', lambda sample: sample.hostAssayPreps(), metrics)
+	micro_preps=timed_query('microb_assay_preps', lambda sample: sample.microbAssayPreps(), metrics)
+	proteomes=timed_query('proteomes', lambda prep: prep.proteomes(), metrics)
+
+	prepprots=list()
+	for subject in subjects(study):
+		for visit in visits(subject):
+			for sample in samples(visit):
+				for prep in host_preps(sample) + micro_preps(sample):
+					proteome_list=proteomes(prep)
+					if len(proteome_list) != 0:
+						prepprots.append(PrepProt(prep, proteome_list))
+	return prepprots
+
+# Retrieve the same proteomes as discover_serial, in the same order, but fan out the OSDF
+# queries of each level of the study -> subject -> visit -> sample -> prep -> proteome
+# hierarchy over a bounded pool of workers.
+def discover_concurrent(study, workers, metrics=None):
+	pool=ThreadPool(workers)
+	try:
+		def children(nodes, name, query):
+			return pool.map(timed_query(name, query, metrics), nodes)
+
+		subjects=timed_query('subjects', lambda study: study.subjects(), metrics)(study)
+		visits=list(chain.from_iterable(children(subjects, 'visits', lambda subject: subject.visits())))
+		samples=list(chain.from_iterable(children(visits, 'samples', lambda visit: visit.samples())))
+		host_preps=children(samples, 'host_assay_preps', lambda sample: sample.hostAssayPreps())
+		micro_preps=children(samples, 'microb_assay_preps', lambda sample: sample.microbAssayPreps())
+
+		preps=list()
+		for host, micro in zip(host_preps, micro_preps):
+			preps.extend(host)
+			preps.extend(micro)
+		proteomes=children(preps, 'proteomes', lambda prep: prep.proteomes())
+	finally:
+		pool.close()
+		pool.join()
+
+	return [PrepProt(prep, proteome_list) for prep, proteome_list in zip(preps, proteomes) if len(proteome_list) != 0]
+
+# Retrieve the proteomes of a study with the given traversal strategy, 'serial' or
+# 'concurrent', and report how long the traversal took. Every OSDF query and the whole
+# traversal are timed in 'metrics', if given.
+def discover_proteomes(study, strategy='concurrent', workers=8, metrics=None):
+	start=time.time()
+	if strategy=='serial':
+		prepprots=discover_serial(study, metrics)
+	else:
+		prepprots=discover_concurrent(study, int(workers), metrics)
+	if metrics is not None:
+		metrics.record('stage', stage='discovery', study=getattr(study, '_id', None), proteome=None,
+		               seconds=round(time.time()-start, 3), strategy=strategy)
+	print('Found %d proteomes in %d assay preps in %.2f seconds (%s traversal)'
+	      % (sum(len(prepprot.proteome) for prepprot in prepprots), len(prepprots), time.time()-start, strategy))
+	return prepprots
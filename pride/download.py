@@ -0,0 +1,400 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+from .checksum import file_checksums
+from .metrics import throughput
+from .slots import SharedBudget, budget_name, claim
+from .upload import completed_files
+
+# Name of the local file a DCC url is downloaded to.
+def local_name(file_url):
+	return urlparse(file_url).path.split('/')[-1]
+
+# Identity of the content of a local file, which changes when ascp replaces it.
+def _identity(file_path):
+	stat=os.stat(file_path)
+	return stat.st_ino, stat.st_size, stat.st_mtime
+
+def _remove(file_path):
+	try:
+		os.remove(file_path)
+	except OSError:
+		pass
+
+# Suffix of the file ascp writes a new version of a file to, until it is complete.
+PARTIAL_SUFFIX='.partial'
+
+# Download several files from a DCC host in a single ascp session, passing them as a file
+# list. Returns the remote paths that were transferred. With 'revalidate', files already in
+# the target folder are only transferred again if they differ from the remote file, and their
+# new version replaces them once complete rather than being written through them, so that a
+# cached object the local file is a link to is never modified.
+def ascp_download(host, dcc_user, dcc_pw, remote_paths, target_dir, revalidate=False):
+	environ=os.environ.copy()
+	environ['ASPERA_SCP_PASS'] = dcc_pw
+	list_file=tempfile.NamedTemporaryFile(mode='w', prefix='ascp_', suffix='.txt', delete=False)
+	try:
+		list_file.write('\n'.join(remote_paths)+'\n')
+		list_file.close()
+		ascp_cmd=["ascp", "-QT", "-l500M", "-k", "2", "--mode=recv", "--host="+host, "--user="+dcc_user,
+		          "--file-list="+list_file.name]
+		if revalidate:
+			ascp_cmd+=["-o", "Overwrite=diff", "--partial-file-suffix="+PARTIAL_SUFFIX]
+		ascp_cmd.append(target_dir)
+		process = subprocess.Popen(ascp_cmd, stdout=subprocess.PIPE,
+		                           stderr=subprocess.PIPE,
+		                           universal_newlines=True,
+		                           env=environ)
+		(s_out, s_err) = process.communicate()
+		if process.returncode == 0:
+			return set(remote_paths)
+		print("Unexpected STDERR from ascp: %s" % s_err)
+		return completed_files(s_out, remote_paths)
+	except OSError as e:
+		print("Encountered an error when running ascp: %s" % e)
+		return set()
+	finally:
+		os.remove(list_file.name)
+
+
+# File name given for a url that a prefetch left to the other process downloading it.
+_SKIPPED=object()
+
+
+class _Download(object):
+	""" Handle of the download of a url, queued on its own or as part of a batch. A url that a
+	prefetch left to another process is waited for when its name is needed.
+	"""
+
+	def __init__(self, pool, job, file_url, result_dir, journal, batch=False):
+		self._pool=pool
+		self._job=job
+		self._file_url=file_url
+		self._result_dir=result_dir
+		self._journal=journal
+		self._batch=batch
+
+	def get(self):
+		file_name=self._job.get()
+		if self._batch:
+			file_name=file_name.get(self._file_url)
+		if file_name is _SKIPPED:
+			return self._pool._download_one(self._file_url, self._result_dir, self._journal)
+		return file_name
+
+
+class DownloadPool(object):
+	""" Bounded pool of workers downloading files from the DCC into result folders.
+
+	At most 'workers' transfers run at once overall, whichever study they are for, and at
+	most 'host_workers' of them against any single DCC host. Every url is downloaded once per
+	result folder, a failed transfer is retried 'retries' times with an exponential backoff
+	and urls that could not be retrieved are recorded in 'failed' instead of aborting the run.
+	If a DownloadCache is given, cached urls are linked into the result folder instead of
+	being transferred again and every completed transfer is added to the cache. With a
+	'batch_size' above one, the files queued together with fetch_all are transferred in
+	shared ascp sessions of up to 'batch_size' files per DCC host, and files missing after
+	such a session are retried one by one. The MD5 and SHA-1 checksums of every file are
+	computed as soon as it is in, while other transfers are still running, and kept in
+	'checksums' by file path. Completed downloads are recorded along with their checksums in
+	the RunJournal of their result folder, if one is given. Every transfer is timed in
+	'metrics', if given, with its size and throughput.
+
+	With a 'slot_dir', the 'workers' and 'host_workers' bounds are shared by every process of
+	the node through SharedBudgets, and every file is claimed by the process downloading it, so
+	that processes queueing the same files download each of them once. Files can be prefetched
+	before they are needed: those another process is downloading are then left to it.
+	"""
+
+	def __init__(self, dcc_user, dcc_pw, workers=4, host_workers=2, retries=3, backoff=5, cache=None, batch_size=0,
+	             metrics=None, slot_dir=None):
+		self.dcc_user=dcc_user
+		self.dcc_pw=dcc_pw
+		self.host_workers=host_workers
+		self.retries=retries
+		self.backoff=backoff
+		self.cache=cache
+		self.batch_size=batch_size
+		self.metrics=metrics
+		self.slot_dir=slot_dir
+		self.failed=list()
+		self.checksums=dict()
+
+		self._pool=ThreadPool(workers)
+		self._lock=threading.Lock()
+		self._host_slots=dict()
+		self._workers_budget=None
+		if slot_dir:
+			self._workers_budget=SharedBudget(os.path.join(slot_dir, 'download_workers'), workers)
+		self._jobs=dict()
+		self._journals=set()
+
+	# Queue the download of a single url into a result folder. Returns a handle whose get()
+	# gives the local file name, or None if the file could not be downloaded. Unless 'wait'
+	# is set, a file another process is downloading is left to it.
+	def fetch(self, file_url, result_dir, journal=None, wait=True):
+		self._load_checksums(result_dir, journal)
+		with self._lock:
+			if (result_dir, file_url) not in self._jobs:
+				job=self._pool.apply_async(self._download_one, (file_url, result_dir, journal, wait))
+				self._jobs[(result_dir, file_url)]=_Download(self, job, file_url, result_dir, journal)
+			return self._jobs[(result_dir, file_url)]
+
+	# Queue the download of several urls into a result folder, batched into shared ascp
+	# sessions per DCC host if batching is enabled. Returns one handle per url.
+	def fetch_all(self, file_urls, result_dir, journal=None, wait=True):
+		if self.batch_size <= 1:
+			return [self.fetch(file_url, result_dir, journal, wait) for file_url in file_urls]
+		self._load_checksums(result_dir, journal)
+		with self._lock:
+			pending=list()
+			for file_url in file_urls:
+				if (result_dir, file_url) not in self._jobs and file_url not in pending:
+					pending.append(file_url)
+			hosts=OrderedDict()
+			for file_url in pending:
+				hosts.setdefault(urlparse(file_url).netloc, list()).append(file_url)
+			for host, host_urls in hosts.items():
+				for start in range(0, len(host_urls), self.batch_size):
+					batch=host_urls[start:start+self.batch_size]
+					job=self._pool.apply_async(self._download_batch, (host, batch, result_dir, journal, wait))
+					for file_url in batch:
+						self._jobs[(result_dir, file_url)]=_Download(self, job, file_url, result_dir, journal, True)
+			return [self._jobs[(result_dir, file_url)] for file_url in file_urls]
+
+	# Queue the download of urls needed later, such as those of the next proteomes, so that
+	# they are transferred while the workers would otherwise be idle. Files another process
+	# is downloading are left to it.
+	def prefetch(self, file_urls, result_dir, journal=None):
+		self.fetch_all(file_urls, result_dir, journal, wait=False)
+
+	def close(self):
+		self._pool.close()
+		self._pool.join()
+
+	# Files of a resumed run already have their checksums in its journal.
+	def _load_checksums(self, result_dir, journal):
+		if journal is None:
+			return
+		with self._lock:
+			if journal.path in self._journals:
+				return
+			self._journals.add(journal.path)
+			for file_name, checksums in journal.checksums().items():
+				self.checksums[os.path.join(result_dir, file_name)]=checksums
+
+	# Transfer slot of a DCC host, shared by every process of the node if there is a slot
+	# folder.
+	def _host_slot(self, host):
+		with self._lock:
+			if host not in self._host_slots:
+				if self.slot_dir:
+					self._host_slots[host]=SharedBudget(os.path.join(self.slot_dir, budget_name('host', host)),
+					                                    self.host_workers)
+				else:
+					self._host_slots[host]=threading.BoundedSemaphore(self.host_workers)
+			if self.slot_dir:
+				return self._host_slots[host].reserve(1)
+			return self._host_slots[host]
+
+	# Slot of a transfer from a DCC host, counting towards the bound of the host and towards
+	# that of all the transfers.
+	@contextmanager
+	def _transfer_slot(self, host):
+		with self._host_slot(host):
+			if self._workers_budget is None:
+				yield
+			else:
+				with self._workers_budget.reserve(1):
+					yield
+
+	# Claim the given files for this process. Returns the paths claimed and the locks to close
+	# once they are downloaded. Claims are taken in the same order by every process, so that
+	# two batches never wait for each other.
+	def _claim_all(self, file_paths, wait):
+		if not self.slot_dir:
+			return set(file_paths), list()
+		claimed=set()
+		locks=list()
+		for file_path in sorted(file_paths, key=os.path.abspath):
+			lock=claim(self.slot_dir, file_path, wait)
+			if lock is not None:
+				claimed.add(file_path)
+				locks.append(lock)
+		return claimed, locks
+
+	def _download_one(self, file_url, result_dir, journal, wait=True):
+		claimed, locks=self._claim_all([os.path.join(result_dir, local_name(file_url))], wait)
+		try:
+			if not claimed:
+				return _SKIPPED
+			file_name=self._download(file_url, result_dir)
+			self._record(file_url, file_name, result_dir, journal)
+			return file_name
+		finally:
+			for lock in locks:
+				lock.close()
+
+	# Download a batch of urls of a single host in one ascp session. Returns the local file
+	# name of every url, None for those that could not be downloaded.
+	def _download_batch(self, host, file_urls, result_dir, journal, wait=True):
+		claimed, locks=self._claim_all([os.path.join(result_dir, local_name(file_url)) for file_url in file_urls], wait)
+		try:
+			file_names=dict()
+			pending=list()
+			for file_url in file_urls:
+				file_name=local_name(file_url)
+				file_path=os.path.join(result_dir, file_name)
+				if file_path not in claimed:
+					file_names[file_url]=_SKIPPED
+				elif os.path.exists(file_path):
+					file_names[file_url]=file_name
+				else:
+					pending.append(file_url)
+			if pending and self.cache is not None:
+				current=self._fetch_cached(host, pending, result_dir)
+				for file_url in current:
+					file_names[file_url]=local_name(file_url)
+				pending=[file_url for file_url in pending if file_url not in current]
+			if pending:
+				self._transfer_batch(host, pending, result_dir, file_names)
+			for file_url, file_name in file_names.items():
+				if file_name is not _SKIPPED:
+					self._record(file_url, file_name, result_dir, journal)
+			return file_names
+		finally:
+			for lock in locks:
+				lock.close()
+
+	def _transfer_batch(self, host, pending, result_dir, file_names):
+		with self._transfer_slot(host):
+			print('Downloading %d files from %s to %s in one session' % (len(pending), host, result_dir))
+			start=time.time()
+			completed=ascp_download(host, self.dcc_user, self.dcc_pw, [urlparse(file_url).path for file_url in pending],
+			                        result_dir)
+			seconds=time.time()-start
+		if self.metrics is not None:
+			paths=[os.path.join(result_dir, local_name(file_url)) for file_url in pending if urlparse(file_url).path in completed]
+			size=sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+			self.metrics.record('transfer_batch', host=host, files=len(pending), completed=len(paths), bytes=size,
+			                    seconds=round(seconds, 3), mb_per_s=round(throughput(size, seconds), 3))
+		for file_url in pending:
+			file_path=os.path.join(result_dir, local_name(file_url))
+			if urlparse(file_url).path in completed and os.path.exists(file_path):
+				self._store(file_url, file_path)
+				file_names[file_url]=local_name(file_url)
+			else:
+				# Files missing after the batch get the retries of individual downloads.
+				file_names[file_url]=self._download(file_url, result_dir)
+
+	# Materialise the cached copies of urls in the result folder and have ascp compare them
+	# with the files at the DCC in one session, so that a file replaced at the DCC under the
+	# same url is downloaded again rather than served from the cache. Returns the urls whose
+	# file is in place, from the cache or downloaded again.
+	def _fetch_cached(self, host, file_urls, result_dir):
+		linked=dict()
+		for file_url in file_urls:
+			file_path=os.path.join(result_dir, local_name(file_url))
+			if self.cache.fetch(file_url, file_path):
+				linked[file_url]=_identity(file_path)
+		if not linked:
+			return set()
+		with self._transfer_slot(host):
+			start=time.time()
+			completed=ascp_download(host, self.dcc_user, self.dcc_pw, [urlparse(file_url).path for file_url in linked],
+			                        result_dir, revalidate=True)
+			seconds=time.time()-start
+		current=set()
+		for file_url, identity in linked.items():
+			file_name=local_name(file_url)
+			file_path=os.path.join(result_dir, file_name)
+			_remove(file_path+PARTIAL_SUFFIX)
+			if urlparse(file_url).path not in completed or not os.path.exists(file_path):
+				# Files that could not be compared are downloaded as if they were not cached.
+				_remove(file_path)
+				continue
+			if _identity(file_path) == identity:
+				print('Using cached copy of file '+file_name)
+			else:
+				print('Cached copy of file %s was out of date, downloaded it again' % file_name)
+				with self._lock:
+					self.checksums.pop(file_path, None)
+				self._store(file_url, file_path)
+			current.add(file_url)
+		if self.metrics is not None:
+			self.metrics.record('cache_revalidation', host=host, files=len(linked), current=len(current),
+			                    seconds=round(seconds, 3))
+		return current
+
+	# MD5 and SHA-1 checksums of a downloaded file, computed once.
+	def _checksums(self, file_path):
+		with self._lock:
+			if file_path in self.checksums:
+				return self.checksums[file_path]
+		checksums=file_checksums(file_path)
+		with self._lock:
+			self.checksums[file_path]=checksums
+		return checksums
+
+	def _record(self, file_url, file_name, result_dir, journal):
+		if file_name is None:
+			return
+		checksums=self._checksums(os.path.join(result_dir, file_name))
+		if journal is not None:
+			journal.file_downloaded(file_url, file_name, checksums)
+
+	def _record_transfer(self, host, file_name, file_path, seconds, attempt):
+		if self.metrics is None:
+			return
+		size=os.path.getsize(file_path) if os.path.exists(file_path) else 0
+		self.metrics.record('transfer', host=host, file=file_name, bytes=size, seconds=round(seconds, 3),
+		                    mb_per_s=round(throughput(size, seconds), 3), attempt=attempt)
+
+	def _store(self, file_url, file_path):
+		if self.cache is None:
+			return
+		try:
+			self.cache.store(file_url, file_path, self._checksums(file_path)[0])
+		except (IOError, OSError, sqlite3.Error) as e:
+			print('Unable to add file %s to the download cache: %s' % (file_path, e))
+
+	def _download(self, file_url, result_dir):
+		import cutlass.aspera as asp
+
+		url=urlparse(file_url)
+		file_name=local_name(file_url)
+		file_path=os.path.join(result_dir, file_name)
+		if os.path.exists(file_path):
+			return file_name
+		if self.cache is not None and self._fetch_cached(url.netloc, [file_url], result_dir):
+			return file_name
+
+		for attempt in range(self.retries + 1):
+			if attempt:
+				delay=self.backoff * 2 ** (attempt - 1)
+				print('Retrying download of %s in %d seconds (attempt %d of %d)' % (file_name, delay, attempt, self.retries))
+				time.sleep(delay)
+			with self._transfer_slot(url.netloc):
+				print('Downloading file '+file_name+' to '+result_dir)
+				start=time.time()
+				try:
+					if asp.download_file(url.netloc, self.dcc_user, self.dcc_pw, url.path, result_dir):
+						print('Download Complete: '+file_name)
+						self._record_transfer(url.netloc, file_name, file_path, time.time()-start, attempt)
+						self._store(file_url, file_path)
+						return file_name
+				except Exception as e:
+					print('Error downloading file %s: %s' % (file_name, e))
+
+		print('Unable to download file ' + file_name)
+		with self._lock:
+			self.failed.append(file_url)
+		return None
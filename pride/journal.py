@@ -0,0 +1,233 @@
+import os
+import json
+import errno
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from . import PrepProt
+
+JOURNAL_NAME='.pride_journal.db'
+
+# Attributes of the cutlass assay prep and proteome instances the pipeline reads, which are
+# journaled so that a resumed run does not have to query OSDF again.
+PREP_FIELDS=('_id', '_species', '_tissue', '_experiment_type', '_protocol_steps')
+PROTEOME_FIELDS=('_id', '_result_url', '_peak_url', '_raw_url', '_other_url', '_instrument_name',
+                 '_exp_description', '_data_processing_protocol')
+
+# Progress of a proteome through the pipeline, in order.
+STEPS=('discovered', 'downloaded', 'validated', 'uploaded')
+
+# Whether a file in the result folder belongs to the journal rather than to the submission.
+def is_journal_file(file_name):
+	return file_name.startswith(JOURNAL_NAME)
+
+def _running(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno == errno.EPERM
+	return True
+
+def _encode(value):
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	if isinstance(value, list):
+		return [_encode(item) for item in value]
+	return value
+
+
+class JournalRecord(object):
+	""" Stand-in for an assay prep or proteome instance restored from the journal. """
+
+	def __init__(self, fields):
+		for name, value in fields.items():
+			setattr(self, name, _encode(value))
+
+
+class RunJournal(object):
+	""" On-disk journal of the progress of a study run, kept in an SQLite database in the
+	result folder.
+
+	It records the proteomes found in OSDF along with the accumulated project metadata, every
+	file downloaded, with its checksums, or uploaded and the last step each proteome
+	completed, so that a run
+	interrupted at any point can be resumed without repeating completed transfers, OSDF
+	queries or validations. Once the submission is uploaded the run is recorded as submitted
+	and is not resumed.
+	"""
+
+	def __init__(self, result_dir):
+		self.path=os.path.join(result_dir, JOURNAL_NAME)
+		self._lock=threading.Lock()
+		self._pid=None
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS discovery (key TEXT PRIMARY KEY, value TEXT)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS proteomes (id TEXT PRIMARY KEY, step INTEGER)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS active (id TEXT PRIMARY KEY, pid INTEGER)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS status (key TEXT PRIMARY KEY, value TEXT)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, url TEXT, '
+			                 'downloaded INTEGER DEFAULT 0, uploaded INTEGER DEFAULT 0, md5 TEXT, sha1 TEXT, '
+			                 'source TEXT)')
+
+	# Connection to the journal database. The tasks of a run may be run by forked processes,
+	# which cannot use the connection of their parent, so every process opens its own.
+	@property
+	def _db(self):
+		if self._pid != os.getpid():
+			self._connection=sqlite3.connect(self.path, check_same_thread=False)
+			self._pid=os.getpid()
+		return self._connection
+
+	@staticmethod
+	def exists(result_dir):
+		return os.path.exists(os.path.join(result_dir, JOURNAL_NAME))
+
+	# Whether the result folder holds the journal of a run that was interrupted before its
+	# submission was uploaded.
+	@staticmethod
+	def resumable(result_dir):
+		if not RunJournal.exists(result_dir):
+			return False
+		journal=RunJournal(result_dir)
+		try:
+			return not journal.submitted()
+		finally:
+			journal.close()
+
+	# Record that the submission.px file was uploaded, which completes the run.
+	def set_submitted(self):
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO status VALUES (?, ?)', ('submitted', '1'))
+
+	def submitted(self):
+		with self._lock:
+			return self._db.execute('SELECT value FROM status WHERE key=?', ('submitted',)).fetchone() is not None
+
+	# Record the proteomes found in OSDF and the project metadata gathered from them.
+	def save_discovery(self, prepprots, project_metadata):
+		records=list()
+		for prepprot in prepprots:
+			prep=dict((name, getattr(prepprot.prep, name, None)) for name in PREP_FIELDS)
+			proteomes=[dict((name, getattr(proteome, name, None)) for name in PROTEOME_FIELDS)
+			           for proteome in prepprot.proteome]
+			records.append([prep, proteomes])
+		# The submission file formats str and other metadata values differently, so their
+		# type is kept along with their value.
+		metadata=[[entry, type(value) is str, value] for entry, value in project_metadata.items()]
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO discovery VALUES (?, ?)', ('proteomes', json.dumps(records)))
+				self._db.execute('INSERT OR REPLACE INTO discovery VALUES (?, ?)', ('project_metadata', json.dumps(metadata)))
+				for prepprot in prepprots:
+					for proteome in prepprot.proteome:
+						self._db.execute('INSERT OR IGNORE INTO proteomes VALUES (?, 0)', (proteome._id,))
+
+	# The proteomes and project metadata recorded by save_discovery, or None if discovery did
+	# not complete in the journaled run.
+	def load_discovery(self):
+		with self._lock:
+			rows=dict(self._db.execute('SELECT key, value FROM discovery').fetchall())
+		if 'proteomes' not in rows or 'project_metadata' not in rows:
+			return None
+		prepprots=[PrepProt(JournalRecord(prep), [JournalRecord(proteome) for proteome in proteomes])
+		           for prep, proteomes in json.loads(rows['proteomes'])]
+		project_metadata=OrderedDict()
+		for entry, is_str, value in json.loads(rows['project_metadata']):
+			if is_str:
+				value=_encode(value)
+			project_metadata[_encode(entry)]=value
+		return prepprots, project_metadata
+
+	# Record that a proteome completed a step, unless it already went further.
+	def set_step(self, proteome_id, step):
+		with self._lock:
+			with self._db:
+				self._db.execute('UPDATE proteomes SET step=MAX(step, ?) WHERE id=?', (STEPS.index(step), proteome_id))
+
+	# Whether a proteome completed the given step.
+	def completed(self, proteome_id, step):
+		with self._lock:
+			row=self._db.execute('SELECT step FROM proteomes WHERE id=?', (proteome_id,)).fetchone()
+		return row is not None and row[0] >= STEPS.index(step)
+
+	# Record that a proteome is being processed by the current process.
+	def set_active(self, proteome_id):
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO active VALUES (?, ?)', (proteome_id, os.getpid()))
+
+	def clear_active(self, proteome_id):
+		with self._lock:
+			with self._db:
+				self._db.execute('DELETE FROM active WHERE id=?', (proteome_id,))
+
+	# Proteomes being processed by processes that are still running. Those of processes of an
+	# interrupted run are ignored.
+	def active_proteomes(self):
+		with self._lock:
+			rows=self._db.execute('SELECT id, pid FROM active').fetchall()
+		return [str(proteome_id) for proteome_id, pid in rows if _running(pid)]
+
+	# Record a downloaded file, along with its MD5 and SHA-1 checksums if given.
+	def file_downloaded(self, file_url, file_name, checksums=None):
+		md5, sha1=checksums or (None, None)
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR IGNORE INTO files (name, url) VALUES (?, ?)', (file_name, file_url))
+				self._db.execute('UPDATE files SET downloaded=1, md5=COALESCE(?, md5), sha1=COALESCE(?, sha1) WHERE name=?',
+				                 (md5, sha1, file_name))
+
+	# Record the compressed copy of a downloaded file, along with its checksums.
+	def file_compressed(self, file_name, compressed_name, checksums):
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO files (name, md5, sha1, source) VALUES (?, ?, ?, ?)',
+				                 (compressed_name, checksums[0], checksums[1], file_name))
+
+	def files_uploaded(self, paths):
+		with self._lock:
+			with self._db:
+				for path in paths:
+					self._db.execute('INSERT OR IGNORE INTO files (name) VALUES (?)', (os.path.basename(path),))
+					self._db.execute('UPDATE files SET uploaded=1 WHERE name=?', (os.path.basename(path),))
+
+	def downloaded_files(self):
+		with self._lock:
+			return set(row[0] for row in self._db.execute('SELECT name FROM files WHERE downloaded=1'))
+
+	# Names of the compressed copies of files, by name of the file they were made of.
+	def compressed_files(self):
+		with self._lock:
+			return dict((str(row[0]), str(row[1])) for row in
+			            self._db.execute('SELECT source, name FROM files WHERE source IS NOT NULL'))
+
+	# MD5 and SHA-1 checksums of the files with known checksums, by file name.
+	def checksums(self):
+		with self._lock:
+			return dict((str(row[0]), (str(row[1]), str(row[2]))) for row in
+			            self._db.execute('SELECT name, md5, sha1 FROM files WHERE sha1 IS NOT NULL'))
+
+	# MD5 checksum recorded for a file, or None if it has none.
+	def file_md5(self, file_name):
+		with self._lock:
+			row=self._db.execute('SELECT md5 FROM files WHERE name=?', (file_name,)).fetchone()
+		return str(row[0]) if row is not None and row[0] is not None else None
+
+	def uploaded_files(self):
+		with self._lock:
+			return set(row[0] for row in self._db.execute('SELECT name FROM files WHERE uploaded=1'))
+
+	# Remove the files of the result folder that were not completely downloaded, or created
+	# by a step that did not complete, in the journaled run.
+	def remove_partial_files(self, result_dir):
+		downloaded=self.downloaded_files() | set(self.compressed_files().values())
+		for file_name in os.listdir(result_dir):
+			file_path=os.path.join(result_dir, file_name)
+			if not is_journal_file(file_name) and file_name not in downloaded and os.path.isfile(file_path):
+				os.remove(file_path)
+
+	def close(self):
+		with self._lock:
+			self._db.close()
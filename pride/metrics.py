@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Stages of the pipeline, in order, as recorded by the 'stage' events of a run.
+STAGES=('discovery', 'download', 'precheck', 'validation', 'compression', 'upload', 'submission_file', 'manifest',
+        'submit')
+
+# Number of proteomes listed in the end of run summary.
+SLOWEST_PROTEOMES=5
+
+MB=1024*1024
+
+# Transfer rate in MB per second, 0 for a transfer that took no measurable time.
+def throughput(size, seconds):
+	if seconds <= 0:
+		return 0.0
+	return size / float(MB) / seconds
+
+# Events recorded in a metrics file, by every run or by the run 'run_id' only.
+def load_events(path, run_id=None):
+	events=list()
+	if not path or not os.path.exists(path):
+		return events
+	with open(path) as _file:
+		for line in _file:
+			try:
+				event=json.loads(line)
+			except ValueError:
+				continue
+			if run_id is None or event.get('run')==run_id:
+				events.append(event)
+	return events
+
+# Escape a Prometheus label value.
+def _label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+	""" Timing events of a pipeline run, appended as JSON lines to 'path'.
+
+	Every event is written with a single append as soon as it is recorded, so that the tasks
+	of a run can record events from any of the processes and threads running them, and the
+	events of every run are told apart by a run id. 'stage' events time a step of a proteome
+	or of a study, the other events time the single OSDF queries, transfers, pg-converter
+	runs and ascp sessions within them. Without a path the events are not recorded.
+	"""
+
+	def __init__(self, path=None, run_id=None):
+		self.path=os.path.abspath(path) if path else None
+		self.run_id=run_id or '%d-%d' % (time.time(), os.getpid())
+		self._lock=threading.Lock()
+
+	def record(self, event, **fields):
+		if self.path is None:
+			return
+		fields.update(run=self.run_id, event=event, time=round(time.time(), 3), pid=os.getpid())
+		line=json.dumps(fields, sort_keys=True)+'\n'
+		with self._lock:
+			descriptor=os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+			try:
+				os.write(descriptor, line)
+			finally:
+				os.close(descriptor)
+
+	# Time the enclosed block and record it as an event. The block can add fields to the
+	# event through the dict it is given.
+	@contextmanager
+	def timer(self, event, **fields):
+		start=time.time()
+		try:
+			yield fields
+		finally:
+			fields['seconds']=round(time.time()-start, 3)
+			self.record(event, **fields)
+
+	# Time the enclosed block as a stage of a study, or of one of its proteomes.
+	def stage(self, stage, study, proteome=None, **fields):
+		return self.timer('stage', stage=stage, study=study, proteome=proteome, **fields)
+
+	# Events recorded by this run.
+	def events(self):
+		return load_events(self.path, self.run_id)
+
+	# Write the totals of the run in the Prometheus text format, for the textfile collector
+	# of the node exporter. The file is replaced at once so that it is never read half written.
+	def write_textfile(self, path, events=None):
+		if events is None:
+			events=self.events()
+		stage_seconds=dict()
+		stage_count=dict()
+		for event in events:
+			if event['event']=='stage':
+				stage_seconds[event['stage']]=stage_seconds.get(event['stage'], 0)+event['seconds']
+				stage_count[event['stage']]=stage_count.get(event['stage'], 0)+1
+		transfers=[event for event in events if event['event'] in ('transfer', 'transfer_batch')]
+		uploads=[event for event in events if event['event']=='ascp_upload']
+		validations=[event for event in events if event['event']=='converter']
+
+		lines=list()
+		def metric(name, kind, description, samples):
+			lines.append('# HELP %s %s' % (name, description))
+			lines.append('# TYPE %s %s' % (name, kind))
+			for labels, value in samples:
+				label_text=','.join('%s="%s"' % (key, _label(label)) for key, label in labels)
+				lines.append('%s%s %s' % (name, '{'+label_text+'}' if label_text else '', repr(round(float(value), 3))))
+
+		metric('pride_stage_seconds_total', 'counter', 'Time spent in each stage of the pipeline.',
+		       [((('stage', stage),), stage_seconds[stage]) for stage in sorted(stage_seconds)])
+		metric('pride_stage_runs_total', 'counter', 'Number of times each stage of the pipeline ran.',
+		       [((('stage', stage),), stage_count[stage]) for stage in sorted(stage_count)])
+		metric('pride_download_bytes_total', 'counter', 'Bytes downloaded from the DCC.',
+		       [((), sum(event['bytes'] for event in transfers))])
+		metric('pride_download_seconds_total', 'counter', 'Time spent in ascp downloads from the DCC.',
+		       [((), sum(event['seconds'] for event in transfers))])
+		metric('pride_upload_bytes_total', 'counter', 'Bytes sent in ascp sessions to PRIDE, including failed ones.',
+		       [((), sum(event['bytes'] for event in uploads))])
+		metric('pride_upload_seconds_total', 'counter', 'Time spent in ascp uploads to PRIDE.',
+		       [((), sum(event['seconds'] for event in uploads))])
+		metric('pride_validation_seconds_total', 'counter', 'Time spent in pg-converter validations.',
+		       [((), sum(event['seconds'] for event in validations))])
+		metric('pride_validation_peak_memory_mb', 'gauge', 'Highest peak memory of a pg-converter JVM.',
+		       [((), max([event['peak_mb'] for event in validations if event.get('peak_mb')] or [0]))])
+		metric('pride_proteomes_total', 'gauge', 'Number of proteomes processed by the run.',
+		       [((), len(set((event['study'], event['proteome']) for event in events
+		                     if event['event']=='stage' and event.get('proteome'))))])
+		metric('pride_run_completion_timestamp_seconds', 'gauge', 'Time the run completed.', [((), time.time())])
+
+		partial_path=path+'.part'
+		with open(partial_path, 'w') as _file:
+			_file.write('\n'.join(lines)+'\n')
+		os.rename(partial_path, path)
+
+	# Print where the time of the run went: the time of every stage, the stage that took the
+	# most time and the proteomes that took the most time.
+	def summary(self, events=None):
+		if events is None:
+			events=self.events()
+		stages=[event for event in events if event['event']=='stage']
+		if not stages:
+			print('No timings were recorded for this run.')
+			return
+		stage_seconds=dict()
+		proteome_seconds=dict()
+		for event in stages:
+			stage_seconds[event['stage']]=stage_seconds.get(event['stage'], 0)+event['seconds']
+			if event.get('proteome'):
+				stages_of=proteome_seconds.setdefault((event['study'], event['proteome']), dict())
+				stages_of[event['stage']]=stages_of.get(event['stage'], 0)+event['seconds']
+		total=sum(stage_seconds.values())
+
+		print('Run summary: %d proteomes in %d studies, %.1f seconds spent in the pipeline stages'
+		      % (len(proteome_seconds), len(set(event['study'] for event in stages if event.get('study'))), total))
+		for stage in sorted(stage_seconds, key=lambda stage: STAGES.index(stage) if stage in STAGES else len(STAGES)):
+			print('\t%-16s %10.1fs %5.1f%%' % (stage, stage_seconds[stage], 100.0*stage_seconds[stage]/(total or 1)))
+		slowest_stage=max(stage_seconds, key=stage_seconds.get)
+		print('Stage that took the most time: %s (%.1f seconds)' % (slowest_stage, stage_seconds[slowest_stage]))
+
+		slowest=sorted(proteome_seconds.items(), key=lambda item: sum(item[1].values()), reverse=True)
+		if slowest:
+			print('Slowest proteomes:')
+		for (study, proteome), stages_of in slowest[:SLOWEST_PROTEOMES]:
+			print('\t%s (study %s) %.1fs: %s' % (proteome, study, sum(stages_of.values()),
+			      ', '.join('%s %.1fs' % (stage, stages_of[stage]) for stage in STAGES if stage in stages_of)))
@@ -1,47 +1,32 @@
 import os
-import inspect
+import copy
 import getpass
-import subprocess
 import sys
-import re
 import shutil
 
-import cutlass
 import anadama.pipelines
 
 from collections import OrderedDict
 from . import workflows
-from . import PrepProt
-
-def get_proteomes(preps):
-	def _ps():
-		for prep in preps:
-			proteome_list=list()
-			for proteome in prep.proteomes():
-				proteome_list.append(proteome)
-			if len(proteome_list)!= 0:
-				yield prep, proteome_list
-	return map(PrepProt._make, _ps())
-
-# Utility function to check whether the required softwares are installed.
-def check_software_dependencies():
-	print('checking software dependencies')
-	# Check if ASCP is installed
-	try:
-		return_status=subprocess.check_output(["ascp", "-A"])
-	except OSError as e:
-		print('ASCP not installed or configured. Please install/configure ASCP.')
-		sys.exit(1)
-	# Check if Java(x64) greater than version 1.8 is intalled
-	try:
-		return_status=subprocess.check_output(["java", "-d64", "-version"], stderr=subprocess.STDOUT)
-	except subprocess.CalledProcessError as e:
-		print('64-bit Java not installed. Please install 64-bit java.')
-		sys.exit(1)
-	version=re.findall('"([^"]*)"',return_status.splitlines()[0])[0]
-	if version<'1.8':
-		print("Java verson 1.8 or greater required.")
-		sys.exit(1)
+from .discovery import discover_proteomes
+from .journal import RunJournal
+from .metrics import Metrics
+from .software import PROBE_FILE, check_software_dependencies
+from .submission import Submission
+from .upload import StreamingUploader
+
+# Find the .anadama_pride config file, in the following places in order of precedence:
+# 1. User's Home directory
+# 2. The directory where the module code is present
+# 3. Any directory included in python path variable
+# Returns the first one found, None if there is none.
+def find_config_file():
+	paths=[os.path.expanduser("~"), os.path.dirname(os.path.abspath(__file__))]+sys.path
+	for path in paths:
+		file_path=os.path.join(path,'.anadama_pride')
+		if os.path.exists(file_path):
+			return file_path
+	return None
 
 
 class PRIDEPipeline(anadama.pipelines.Pipeline):
@@ -69,12 +54,38 @@ class PRIDEPipeline(anadama.pipelines.Pipeline):
 			"dcc_user": None,
 			"dcc_pw": None,
 			"study_id": None,
+			"download_workers": 4,
+			"host_workers": 2,
+			"download_retries": 3,
+			"download_batch_size": 0,
+			"validation_mode": "service",
+			"validation_workers": 1,
+			"validation_memory": None,
+			"cache_dir": "~/.anadama_pride_cache",
+			"cache_size": 100,
+			"force_validation": False,
+			"precheck_files": True,
+			"discovery": "concurrent",
+			"discovery_workers": 8,
+			"compress_files": False,
+			"compression_workers": 0,
+			"compression_threshold": 0.8,
+			"disk_limit": 0,
+			"resume": True,
+			"metrics_file": "pride_metrics.jsonl",
+			"metrics_textfile": "pride_metrics.prom",
+			"dry_run": False,
 		},
 		"submit": {
 			"pride_user": None,
 			"pride_pw": None,
 			"pride_server": None,
 			"pride_directory": None,
+			"streaming": False,
+			"upload_sessions": 4,
+			"upload_bandwidth": "500M",
+			"upload_retries": 2,
+			"checksum_workers": 4,
 		}
 	}
 
@@ -116,34 +127,18 @@ class PRIDEPipeline(anadama.pipelines.Pipeline):
 		""""""
 		super(PRIDEPipeline, self).__init__(*args, **kwargs)
 
-		check_software_dependencies()
-		config_file=None
-
-		# Check if config file is present in the following places in order of precedence:
-		# 1. User's Home directory
-		# 2. The directory where the module code is present
-		# 3. Any directory included in python path variable
-		path=os.path.expanduser("~")
-		file_path=os.path.join(path,'.anadama_pride')
-		if config_file is None and os.path.exists(file_path):
-			config_file=file_path
-
-		path=os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-		file_path=os.path.join(path,'.anadama_pride')
-		if config_file is None and os.path.exists(file_path):
-			config_file=file_path
-
-		paths=sys.path
-		for path in paths:
-			file_path=os.path.join(path,'.anadama_pride')
-			if config_file is None and os.path.exists(file_path):
-				config_file=file_path
-
+		# The software the stages run is only checked, and the study id only asked for, once
+		# a run is configured, and the config file search stops at the first one found, so
+		# that listing the pipeline or its help does not wait for any of them.
+		config_file=find_config_file()
 		if config_file is None:
 			print('Config file not present.')
 			sys.exit(1)
 
-		self.options = self.default_options.copy()
+		# The options and project metadata of the class are copied, so that they are not
+		# shared with other instances or the studies of a batch.
+		self.options = copy.deepcopy(self.default_options)
+		self.project_metadata = copy.deepcopy(self.project_metadata)
 		# Update the options to user provided options
 		for k in self.options.iterkeys():
 			self.options[k].update(workflow_options.get(k, {}))
@@ -175,12 +170,10 @@ class PRIDEPipeline(anadama.pipelines.Pipeline):
 					print('The length of the Project Description field must be between 50 to 500 charachters.')
 					sys.exit(1)
 		_file.close()
-		if not self.options['collect'].get('study_id', None):
-			prompt="Enter the study ID to submit: "
-			self.options['collect']['study_id'] = raw_input(prompt)
 
 
-	def metadata_from_prep(self,prepprot):
+	# Gather the project metadata of a study from one of its assay preps and its proteomes.
+	def metadata_from_prep(self,prepprot,project_metadata):
 		assay_prep = prepprot.prep
 
 		# There might be multiple proteome and multiple assay_preps included in one submission.
@@ -188,47 +181,52 @@ class PRIDEPipeline(anadama.pipelines.Pipeline):
 		# assay_preps that belong to the study being submitted. Therefore, the metadata field
 		# 'sample_processing_protocol' is populated only from the first assay prep encountered.
 
-		if(self.project_metadata["sample_processing_protocol"] is None):
+		if(project_metadata["sample_processing_protocol"] is None):
 			spp_string=assay_prep._protocol_steps
 			if (len(spp_string) < 50 or len(spp_string) > 500):
 				print('The length of the Sample Processing Protocol field must be between 50 to 500 charachters.\n'
 				      'Please update the field protocol_steps in the related assay_prep entry in OSDF.')
 				sys.exit(1)
-			self.project_metadata["sample_processing_protocol"] = spp_string
+			project_metadata["sample_processing_protocol"] = spp_string
 
-		if assay_prep._experiment_type not in self.project_metadata["experiment_type"]:
-			self.project_metadata["experiment_type"].append(assay_prep._experiment_type)
+		if assay_prep._experiment_type not in project_metadata["experiment_type"]:
+			project_metadata["experiment_type"].append(assay_prep._experiment_type)
 
-		if assay_prep._species not in self.project_metadata["keywords"]:
-			self.project_metadata["keywords"] = self.project_metadata["keywords"] + assay_prep._species
+		if assay_prep._species not in project_metadata["keywords"]:
+			project_metadata["keywords"] = project_metadata["keywords"] + assay_prep._species
 
-		if assay_prep._species not in self.project_metadata["species"]:
-			self.project_metadata["species"].append(assay_prep._species)
+		if assay_prep._species not in project_metadata["species"]:
+			project_metadata["species"].append(assay_prep._species)
 
-		if assay_prep._tissue not in self.project_metadata["tissue"]:
-			self.project_metadata["tissue"].append(assay_prep._tissue)
+		if assay_prep._tissue not in project_metadata["tissue"]:
+			project_metadata["tissue"].append(assay_prep._tissue)
 
 		for proteome in prepprot.proteome:
-			if proteome._instrument_name not in self.project_metadata["instrument"]:
-				self.project_metadata["instrument"].append(proteome._instrument_name)
+			if proteome._instrument_name not in project_metadata["instrument"]:
+				project_metadata["instrument"].append(proteome._instrument_name)
 
 			# There might be multiple proteomes included in one submission.
 			# The assumption made here is that the data processing protocol remains the same for all the
 			# proteomes that belong to the study being submitted. Therefore, the metadata field
 			# 'data_processing_protocol' is populated only from the first proteome encountered.
 
-			if (self.project_metadata["data_processing_protocol"] is None):
+			if (project_metadata["data_processing_protocol"] is None):
 				dpp_string = proteome._data_processing_protocol
 				if (len(dpp_string) < 50 or len(dpp_string) > 500):
 					print('The length of the Data Processing Protocol field must be between 50 to 500 charachters.\n'
 					      'Please update the field data_processing_protocol in the related proteome entry in OSDF.')
 					sys.exit(1)
-				self.project_metadata["data_processing_protocol"] = dpp_string
+				project_metadata["data_processing_protocol"] = dpp_string
 
 
 
 
 	def _configure(self):
+		import cutlass
+
+		if not self.options['collect'].get('study_id', None):
+			prompt="Enter the study ID to submit, or several separated by commas: "
+			self.options['collect']['study_id'] = raw_input(prompt)
 
 		session = cutlass.iHMPSession(self.options['collect']['dcc_user'],
 									  self.options['collect']['dcc_pw'])
@@ -240,42 +238,137 @@ class PRIDEPipeline(anadama.pipelines.Pipeline):
 			print('Cannot connect to OSDF. Please check OSDF Username and Password')
 			sys.exit(1)
 
+		collect_options=self.options['collect'].copy()
+		study_ids=[study_id.strip() for study_id in str(collect_options.pop('study_id')).split(',') if study_id.strip()]
+		discovery=(collect_options.pop('discovery'), collect_options.pop('discovery_workers'))
+		resume=workflows.option_flag(collect_options.pop('resume'))
+		dry_run=workflows.option_flag(collect_options.pop('dry_run'))
+		# The stages of the run are timed in a JSON lines file shared by all the studies, and
+		# their totals written to a Prometheus textfile once every study is submitted.
+		metrics=Metrics(collect_options.pop('metrics_file'))
+		textfile=collect_options.pop('metrics_textfile')
+		submit_options=self.options['submit'].copy()
+		streaming=workflows.option_flag(submit_options.pop('streaming'))
+		# With a disk limit the files of every proteome are uploaded and removed as soon as
+		# they are validated.
+		if float(collect_options['disk_limit']) > 0 and not streaming:
+			print('Uploading the files of every proteome as soon as they are validated to stay within the disk limit')
+			streaming=True
+
+		# Several studies can be submitted in one run. They share the OSDF session and the
+		# download pool, caches and validator, and the tasks of all of them are handed to the
+		# runner together, so that no worker waits for a single study to finish.
+		resources=workflows.CollectResources(metrics=metrics,
+		                                     **dict((name, collect_options.pop(name)) for name in workflows.RESOURCE_OPTIONS))
+
+		# The downloads and uploads run ascp and the validations Java, which a dry run does
+		# not. The checks that passed are kept in the cache folder until the binaries change.
+		if not dry_run:
+			check_software_dependencies(('ascp', 'java'),
+			                            os.path.join(resources.cache_dir, PROBE_FILE) if resources.cache_dir else None)
+
+		# A dry run only plans the submission of every study.
+		if dry_run:
+			for study_id in study_ids:
+				yield self._plan_study(study_id, resources, discovery, resume, submit_options, metrics)
+			return
+
+		for study_id in study_ids:
+			for tasks in self._configure_study(study_id, session, resources, discovery, resume, streaming,
+			                                   collect_options, submit_options, metrics):
+				yield tasks
+
+		# Where the time of the run went is reported at the end of the run.
+		result_dirs=[os.path.join(os.getcwd(),study_id) for study_id in study_ids]
+		yield workflows.report(metrics, result_dirs, os.path.abspath(textfile) if textfile else None)
+
+
+	# Retrieve the assay preps of a study along with their proteomes and gather the project
+	# metadata from them, from the journal of an interrupted run if it completed the discovery,
+	# else from OSDF. Returns the assay preps and whether they were retrieved from OSDF.
+	def _discover(self, study_id, discovery, project_metadata, metrics, journal=None):
+		journaled=journal.load_discovery() if journal is not None else None
+		if journaled is not None:
+			prepprots, journaled_metadata=journaled
+			project_metadata.update(journaled_metadata)
+			print('Restored %d assay preps and the project metadata from the run journal' % len(prepprots))
+			return prepprots, False
+
+		import cutlass
+
 		# Retrive the study instance for the id number provided.
 		try:
-			study = cutlass.Study.load(self.options['collect']['study_id'])
+			study = cutlass.Study.load(study_id)
 		except Exception as e:
 			print('No study found with the entered study ID')
 			sys.exit(1)
 
-		# The name of folder containg the data to be submitted is the OSDF id of study being submitted.
-		result_dir=os.path.join(os.getcwd(),self.options['collect']['study_id'])
-
-		if os.path.exists(result_dir):
-			print('Removing existing result folder')
-			shutil.rmtree(result_dir)
-		os.mkdir(result_dir, 0777)
-
 		# Retrieve each proteome derived from either a host assay prep or a micrebiome assay prep
 		# prepared form each sample collected during each visit by each subject that participated
 		# in the given study.
-		record_proteomes=list()
-		for subject in study.subjects():
-			for visit in subject.visits():
-				for sample in visit.samples():
-					host_assay_preps=get_proteomes(sample.hostAssayPreps())
-					if host_assay_preps:
-						record_proteomes.append(host_assay_preps)
-					micro_assay_preps=get_proteomes(sample.microbAssayPreps())
-					if micro_assay_preps:
-						record_proteomes.append(micro_assay_preps)
-
-		# For each proteome retrieved, download and validate the data files.
-		for record in record_proteomes:
-			for prepprot in record:
-				self.metadata_from_prep(prepprot)
-
-				yield workflows.collect(session,prepprot,result_dir,**self.options['collect'])
+		prepprots=discover_proteomes(study, *discovery, metrics=metrics)
+		for prepprot in prepprots:
+			self.metadata_from_prep(prepprot, project_metadata)
+		return prepprots, True
+
+
+	# Yields the task planning the submission of a single study. The result folder is left as
+	# it is: only the journal of a run that would be resumed is read.
+	def _plan_study(self, study_id, resources, discovery, resume, submit_options, metrics):
+		project_metadata = copy.deepcopy(self.project_metadata)
+		result_dir=os.path.join(os.getcwd(),study_id)
+		journal=None
+		if resume and RunJournal.resumable(result_dir):
+			journal=RunJournal(result_dir)
+		prepprots, discovered=self._discover(study_id, discovery, project_metadata, metrics, journal)
+		return workflows.plan(Submission(), prepprots, result_dir, project_metadata, resources, metrics,
+		                      submit_options['upload_sessions'], submit_options['upload_bandwidth'], journal)
+
+
+	# Yields the tasks submitting a single study, with a submission and project metadata of its
+	# own.
+	def _configure_study(self, study_id, session, resources, discovery, resume, streaming, collect_options, submit_options,
+	                     metrics):
+		project_metadata = copy.deepcopy(self.project_metadata)
+
+		# The name of folder containg the data to be submitted is the OSDF id of study being submitted.
+		result_dir=os.path.join(os.getcwd(),study_id)
+
+		# A run interrupted before submitting is resumed from its journal in the result folder,
+		# unless a fresh run is requested. A run that was submitted is started over.
+		if resume and RunJournal.resumable(result_dir):
+			print('Resuming the interrupted run of study '+study_id+' in the existing result folder')
+		else:
+			if resume and RunJournal.exists(result_dir):
+				print('The previous run of study '+study_id+' was submitted, starting a new run')
+			if os.path.exists(result_dir):
+				print('Removing existing result folder')
+				shutil.rmtree(result_dir)
+			os.mkdir(result_dir, 0777)
+		journal=RunJournal(result_dir)
+
+		prepprots, discovered=self._discover(study_id, discovery, project_metadata, metrics, journal)
+		if discovered:
+			journal.save_discovery(prepprots, project_metadata)
+
+		# The files and sample metadata to be submitted for this study.
+		submission=Submission()
+
+		# In streaming mode the files of each proteome are uploaded as soon as they are validated,
+		# while the remaining proteomes are still being downloaded and validated.
+		uploader=None
+		if streaming:
+			uploader=StreamingUploader(result_dir, submit_options['pride_user'], submit_options['pride_pw'],
+			                           submit_options['pride_server'], submit_options['pride_directory'],
+			                           submit_options['upload_sessions'], submit_options['upload_bandwidth'],
+			                           submit_options['upload_retries'], journal=journal, metrics=metrics,
+			                           slot_dir=resources.slot_dir)
+
+		# Download and validate the data files of all the proteomes retrieved.
+		yield workflows.collect(session,submission,prepprots,result_dir,resources,study_id,uploader=uploader,journal=journal,
+		                        metrics=metrics,**collect_options)
 
 		# After all the proteome data included in this study is retrieved and validated,
 		# create a submission summary file and submit the data to the PRIDE repository.
-		yield workflows.submit(result_dir,self.project_metadata,**self.options['submit'])
\ No newline at end of file
+		yield workflows.submit(submission,result_dir,project_metadata,uploader=uploader,journal=journal,metrics=metrics,
+		                       slot_dir=resources.slot_dir,**submit_options)
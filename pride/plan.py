@@ -0,0 +1,170 @@
+import os
+from urlparse import urlparse
+
+from .download import local_name
+from .upload import rate_kbps
+
+MB=1024*1024
+
+# Rate of the ascp sessions downloading from the DCC, when no download was recorded yet.
+NOMINAL_DOWNLOAD_RATE='500M'
+
+# Sizes of the files to download: those already in the result folder, else those recorded by
+# the download cache for their url, else the average size of the cached files with the same
+# extension. Returns a list of (url, file name, size, source of the size) in the order of the
+# urls, with a size of None when nothing is known about it.
+def file_sizes(file_urls, result_dir, cached_sizes):
+	averages=dict()
+	for url, size in cached_sizes.items():
+		averages.setdefault(os.path.splitext(local_name(url))[1].lower(), list()).append(size)
+	averages=dict((extension, sum(sizes) / len(sizes)) for extension, sizes in averages.items())
+
+	sizes=list()
+	for file_url in file_urls:
+		file_name=local_name(file_url)
+		file_path=os.path.join(result_dir, file_name)
+		extension=os.path.splitext(file_name)[1].lower()
+		if os.path.isfile(file_path):
+			sizes.append((file_url, file_name, os.path.getsize(file_path), 'local'))
+		elif file_url in cached_sizes:
+			sizes.append((file_url, file_name, cached_sizes[file_url], 'cache'))
+		elif extension in averages:
+			sizes.append((file_url, file_name, averages[extension], 'estimated'))
+		else:
+			sizes.append((file_url, file_name, None, 'unknown'))
+	return sizes
+
+# Rates recorded by the metrics of earlier runs: the MB per second of a single ascp download
+# and upload session and the pg-converter seconds per MB of result and peak file, None for
+# those that were never recorded.
+def recorded_rates(events):
+	totals={'download': [0, 0], 'upload': [0, 0], 'validation': [0, 0]}
+	kinds={'transfer': 'download', 'transfer_batch': 'download', 'ascp_upload': 'upload', 'converter': 'validation'}
+	for event in events:
+		kind=kinds.get(event.get('event'))
+		if kind is not None and event.get('bytes') and event.get('seconds'):
+			totals[kind][0]+=event['bytes'] / float(MB)
+			totals[kind][1]+=event['seconds']
+	rates=dict()
+	for kind in ('download', 'upload'):
+		megabytes, seconds=totals[kind]
+		rates[kind]=megabytes / seconds if seconds else None
+	megabytes, seconds=totals['validation']
+	rates['validation']=seconds / megabytes if megabytes else None
+	return rates
+
+# Format a duration in seconds as hours, minutes and seconds.
+def format_duration(seconds):
+	if seconds is None:
+		return 'unknown'
+	minutes, seconds=divmod(int(round(seconds)), 60)
+	hours, minutes=divmod(minutes, 60)
+	if hours:
+		return '%dh %02dm' % (hours, minutes)
+	if minutes:
+		return '%dm %02ds' % (minutes, seconds)
+	return '%ds' % seconds
+
+def format_size(size):
+	return '%.2f GB' % (size / float(1024*MB))
+
+
+class StudyPlan(object):
+	""" What a run would transfer and validate for a study, and how long it would take.
+
+	'proteome_files' lists the proteome ids of the study along with the urls of their files,
+	result and peak file first, as mapped in the submission. A file shared by several
+	proteomes is listed once, for the first of them. The sizes of the files are taken from the
+	result folder and the download cache, and the times are estimated from the rates recorded
+	by the metrics of earlier runs, or from the nominal ascp rates if no transfer was recorded
+	yet. Files of unknown size are left out of the totals, which are then reported as lower
+	bounds. Cached files are only taken from the cache if 'use_cache' is set.
+	"""
+
+	def __init__(self, study_id, result_dir, proteome_files, cached_sizes, uploaded=(), use_cache=True):
+		self.study_id=study_id
+		self.result_dir=result_dir
+		self.uploaded=set(uploaded)
+		self.use_cache=use_cache
+		self.files=list()
+		listed=set()
+		for proteome_id, file_urls in proteome_files:
+			for index, (file_url, file_name, size, source) in enumerate(file_sizes(file_urls, result_dir, cached_sizes)):
+				if file_url in listed:
+					continue
+				listed.add(file_url)
+				file_type=('result', 'peak')[index] if index < 2 else 'raw'
+				self.files.append((proteome_id, file_type, file_url, file_name, size, source))
+
+	def _total(self, files):
+		return sum(size for proteome_id, file_type, file_url, file_name, size, source in files if size is not None)
+
+	# Total size of the files, as a lower bound if some are of unknown size.
+	def _volume(self, files):
+		unknown=len([record for record in files if record[4] is None])
+		if unknown:
+			return 'at least %s (%d files of unknown size)' % (format_size(self._total(files)), unknown)
+		return format_size(self._total(files))
+
+	# Files that would be downloaded: all but those in the result folder or the download cache.
+	def downloads(self):
+		present=('local', 'cache') if self.use_cache else ('local',)
+		return [record for record in self.files if record[5] not in present]
+
+	def validations(self):
+		return [record for record in self.files if record[1] in ('result', 'peak')]
+
+	def uploads(self):
+		return [record for record in self.files if record[3] not in self.uploaded]
+
+	# Write the file plan as a tab separated file, one line per file.
+	def write(self, path):
+		with open(path, 'w') as _file:
+			_file.write('proteome\tfile_type\tfile_name\turl\tsize\tsize_source\tdownload\n')
+			downloads=set(record[2] for record in self.downloads())
+			for proteome_id, file_type, file_url, file_name, size, source in self.files:
+				_file.write('\t'.join([proteome_id, file_type, file_name, file_url, '' if size is None else str(size),
+				                       source, 'yes' if file_url in downloads else 'no'])+'\n')
+
+	# Print the volume of the study and the estimated time of every stage.
+	def report(self, rates, download_workers, host_workers, validation_workers, upload_sessions, upload_bandwidth):
+		proteomes=len(set(record[0] for record in self.files))
+		unknown=[record for record in self.files if record[4] is None]
+		estimated=[record for record in self.files if record[5]=='estimated']
+		print('Plan for study %s: %d proteomes, %d files, %s' % (self.study_id, proteomes, len(self.files),
+		      self._volume(self.files)))
+		if estimated or unknown:
+			print('\tsizes of %d files estimated from cached files of the same type, %d unknown and left out of the '
+			      'totals and times, which are lower bounds' % (len(estimated), len(unknown)))
+
+		downloads=self.downloads()
+		hosts=len(set(urlparse(record[2]).netloc for record in downloads))
+		sessions=max(1, min(int(download_workers), int(host_workers)*max(1, hosts), len(downloads)))
+		self._estimate('download', downloads, rates['download'], sessions, rate_kbps(NOMINAL_DOWNLOAD_RATE)*1000/8.0/MB)
+
+		validations=self.validations()
+		validation_mb=self._total(validations) / float(MB)
+		bound='at least ' if [record for record in validations if record[4] is None] else ''
+		if rates['validation'] is None:
+			print('\tvalidation: %s%.1f MB of result and peak files, no validation recorded to estimate its time'
+			      % (bound, validation_mb))
+		else:
+			print('\tvalidation: %s%.1f MB of result and peak files, %s%s at %.2f s/MB with %d workers (recorded)'
+			      % (bound, validation_mb, bound,
+			         format_duration(validation_mb*rates['validation']/int(validation_workers)), rates['validation'],
+			         int(validation_workers)))
+
+		uploads=self.uploads()
+		sessions=max(1, min(int(upload_sessions), len(uploads)))
+		self._estimate('upload', uploads, rates['upload'], sessions, rate_kbps(upload_bandwidth)*1000/8.0/MB/int(upload_sessions))
+
+	def _estimate(self, stage, files, rate, sessions, nominal_rate):
+		size=self._total(files)
+		bound='at least ' if [record for record in files if record[4] is None] else ''
+		source='recorded'
+		if rate is None:
+			rate=nominal_rate
+			source='nominal rate, none recorded'
+		print('\t%s: %d files, %s, %s%s at %.1f MB/s per session with %d sessions (%s)'
+		      % (stage, len(files), self._volume(files), bound,
+		         format_duration(size/float(MB)/rate/sessions if files else 0), rate, sessions, source))
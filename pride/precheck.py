@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import tempfile
+import xml.etree.cElementTree as ElementTree
+
+# mzIdentML elements counted as proteins, peptides and identified spectra.
+MZID_COUNTS=[
+	('DBSequence', 'Total proteins'),
+	('Peptide', 'Total peptides'),
+	('SpectrumIdentificationResult', 'Total spectra'),
+]
+SPECTRUM_TITLE='MS:1000796'
+
+# Spectrum titles kept in memory before they are spilled to a temporary database, and number
+# of titles of the peak file looked up in it at once.
+TITLES_IN_MEMORY=500000
+TITLE_BATCH=10000
+
+def _local_tag(tag):
+	return tag.rsplit('}', 1)[-1]
+
+
+class TitleSet(object):
+	""" Set of the spectrum titles referenced by a result file.
+
+	Up to 'limit' titles are kept in memory. Beyond, they are moved to a temporary SQLite
+	database in batches of 'limit', so that the memory used by a precheck stays bounded
+	whatever the number of spectra the result file references.
+	"""
+
+	def __init__(self, limit=TITLES_IN_MEMORY):
+		self.limit=limit
+		self._titles=set()
+		self._db=None
+		self._path=None
+
+	def add(self, title):
+		self._titles.add(title)
+		if len(self._titles) >= self.limit:
+			self._spill()
+
+	# Remove the given titles from the set.
+	def discard_all(self, titles):
+		if self._db is None:
+			self._titles.difference_update(titles)
+			return
+		self._spill()
+		with self._db:
+			self._db.executemany('DELETE FROM titles WHERE title=?', ((title,) for title in titles))
+
+	def __len__(self):
+		if self._db is None:
+			return len(self._titles)
+		self._spill()
+		return self._db.execute('SELECT COUNT(*) FROM titles').fetchone()[0]
+
+	# The first title of the set in sorted order, or None if it is empty.
+	def first(self):
+		if self._db is None:
+			return min(self._titles) if self._titles else None
+		self._spill()
+		return self._db.execute('SELECT MIN(title) FROM titles').fetchone()[0]
+
+	def close(self):
+		if self._db is not None:
+			self._db.close()
+			os.remove(self._path)
+			self._db=None
+
+	def _spill(self):
+		if self._db is None:
+			descriptor, self._path=tempfile.mkstemp(prefix='precheck_', suffix='.db')
+			os.close(descriptor)
+			self._db=sqlite3.connect(self._path)
+			self._db.text_factory=str
+			self._db.execute('PRAGMA journal_mode=OFF')
+			self._db.execute('PRAGMA synchronous=OFF')
+			self._db.execute('CREATE TABLE titles (title TEXT PRIMARY KEY)')
+		with self._db:
+			self._db.executemany('INSERT OR IGNORE INTO titles VALUES (?)', ((title,) for title in self._titles))
+		self._titles=set()
+
+
+# Make one streaming pass over an mzIdentML file, counting its proteins, peptides and
+# identified spectra and gathering the peak file spectra they reference: the highest
+# 'index=' reference, which is returned, and the referenced spectrum titles, which are added
+# to the TitleSet 'titles'. Every element is discarded as soon as it has been read and the
+# titles beyond TITLES_IN_MEMORY are kept on disk, so the memory used does not grow with the
+# size of the file.
+def scan_mzid(path, titles):
+	counts=dict((name, 0) for tag, name in MZID_COUNTS)
+	tags=dict(MZID_COUNTS)
+	max_index=-1
+
+	stack=list()
+	spectrum_id=None
+	spectrum_title=None
+	for event, elem in ElementTree.iterparse(path, events=('start', 'end')):
+		tag=_local_tag(elem.tag)
+		if event=='start':
+			stack.append(elem)
+			if tag=='SpectrumIdentificationResult':
+				spectrum_id=elem.get('spectrumID', '')
+				spectrum_title=None
+			continue
+
+		stack.pop()
+		if tag in tags:
+			counts[tags[tag]]+=1
+		if tag=='cvParam' and elem.get('accession')==SPECTRUM_TITLE and spectrum_id is not None:
+			spectrum_title=elem.get('value')
+		elif tag=='SpectrumIdentificationResult':
+			if spectrum_id.startswith('index='):
+				max_index=max(max_index, int(spectrum_id[len('index='):]))
+			elif spectrum_title is not None:
+				titles.add(spectrum_title)
+			spectrum_id=None
+		elem.clear()
+		if stack:
+			del stack[-1][-1]
+	return counts, max_index
+
+# Make one streaming pass over an MGF peak file, line by line. Returns the number of spectra
+# and the titles of the given TitleSet that could not be found in the file, which are removed
+# from it as the file is read.
+def scan_mgf(path, titles):
+	spectra=0
+	searching=len(titles) > 0
+	found=list()
+	in_spectrum=False
+	with open(path) as _file:
+		for line in _file:
+			line=line.strip()
+			if line=='BEGIN IONS':
+				in_spectrum=True
+			elif line=='END IONS' and in_spectrum:
+				in_spectrum=False
+				spectra+=1
+			elif in_spectrum and searching and line.startswith('TITLE='):
+				found.append(line[len('TITLE='):])
+				if len(found) >= TITLE_BATCH:
+					titles.discard_all(found)
+					found=list()
+					searching=len(titles) > 0
+	titles.discard_all(found)
+	return spectra, titles
+
+# Check a result file against its peak file before running pg-converter. Returns the counts
+# read from the files and the list of problems found, empty if the pair looks valid.
+def precheck(result_path, peak_path):
+	problems=list()
+	titles=TitleSet()
+	try:
+		try:
+			counts, max_index=scan_mzid(result_path, titles)
+		except (SyntaxError, ValueError) as e:
+			return dict(), ['Result file is not valid mzIdentML: %s' % e]
+		if counts['Total spectra'] < 1:
+			problems.append('Result file does not identify any spectra')
+
+		spectra, missing=scan_mgf(peak_path, titles)
+		counts['Peak spectra']=spectra
+		if spectra < 1:
+			problems.append('Peak file does not contain any spectra')
+		if max_index >= spectra:
+			problems.append('Result file references spectrum index=%d but the peak file has %d spectra' % (max_index, spectra))
+		if len(missing):
+			problems.append('%d spectrum titles referenced by the result file are not in the peak file, e.g. %s'
+			                % (len(missing), missing.first()))
+	finally:
+		titles.close()
+	return counts, problems
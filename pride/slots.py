@@ -0,0 +1,151 @@
+import os
+import re
+import time
+import errno
+import fcntl
+import hashlib
+import tempfile
+import threading
+import itertools
+from contextlib import contextmanager
+
+# Seconds between two attempts to reserve a share of a budget that is used up.
+BUDGET_POLL=0.2
+
+# Folder of the budgets shared by the processes running pipeline tasks on a node: in the
+# download cache folder if there is one, else in the temporary folder of the user.
+def slot_dir(cache_dir=None):
+	if cache_dir:
+		return os.path.join(cache_dir, 'slots')
+	return os.path.join(tempfile.gettempdir(), 'anadama_pride_slots_%d' % os.getuid())
+
+# Name of the budget file of a resource such as a DCC host.
+def budget_name(*parts):
+	return re.sub(r'[^A-Za-z0-9_.-]', '_', '-'.join(str(part) for part in parts))
+
+# Keep the lock of 'lock_file' from being inherited by the processes started while it is held,
+# such as a validator JVM, which would hold it for as long as they run.
+def _close_on_exec(lock_file):
+	flags=fcntl.fcntl(lock_file.fileno(), fcntl.F_GETFD)
+	fcntl.fcntl(lock_file.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+	return lock_file
+
+# Claim 'path' for this process, such as to download a file, until the returned lock file is
+# closed. Waits while another process holds the claim, or returns None if 'wait' is false.
+def claim(slot_dir, path, wait=True):
+	claim_dir=os.path.join(slot_dir, 'claims')
+	if not os.path.isdir(claim_dir):
+		try:
+			os.makedirs(claim_dir)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+	lock=_close_on_exec(open(os.path.join(claim_dir, hashlib.md5(os.path.abspath(path)).hexdigest()), 'a'))
+	try:
+		fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except IOError as e:
+		lock.close()
+		if e.errno in (errno.EAGAIN, errno.EACCES):
+			return None
+		raise
+	return lock
+
+# Whether the process 'pid' is still running.
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno==errno.EPERM
+	return True
+
+
+class SharedBudget(object):
+	""" Budget of a resource shared by all the processes running pipeline tasks on a node,
+	such as the transfer slots of a DCC host, the MB of memory of the validator JVMs or the
+	Kbps of the upload bandwidth.
+
+	The reservations are listed in the ledger file at 'path', which is only read and written
+	under an exclusive lock, and those of processes that exited are dropped, so that a process
+	that crashed does not keep its share. A reservation is granted once it fits in what is left
+	of 'capacity', or when nothing else is reserved so that a reservation larger than the
+	whole budget does not wait forever. A 'capacity' that changes, such as the disk space left,
+	is given as a function, which is called under the lock of the ledger.
+	"""
+
+	_tokens=itertools.count()
+
+	def __init__(self, path, capacity):
+		self.path=path
+		self.capacity=capacity
+		if not os.path.isdir(os.path.dirname(path)):
+			try:
+				os.makedirs(os.path.dirname(path))
+			except OSError as e:
+				if e.errno != errno.EEXIST:
+					raise
+
+	# Apply 'change' to the live reservations of the ledger, a list of (pid, token, amount),
+	# and write them back. Returns what 'change' returns.
+	def _update(self, change):
+		with _close_on_exec(open(self.path, 'a+')) as ledger:
+			fcntl.flock(ledger, fcntl.LOCK_EX)
+			try:
+				ledger.seek(0)
+				reservations=list()
+				for line in ledger:
+					fields=line.split()
+					if len(fields)==3 and _alive(int(fields[0])):
+						reservations.append((int(fields[0]), fields[1], int(fields[2])))
+				result=change(reservations)
+				ledger.seek(0)
+				ledger.truncate()
+				ledger.write(''.join('%d %s %d\n' % reservation for reservation in reservations))
+				ledger.flush()
+			finally:
+				fcntl.flock(ledger, fcntl.LOCK_UN)
+		return result
+
+	# Reserve 'amount' of the budget, or as much of it as is left if that is at least
+	# 'minimum'. Returns the token of the reservation and the amount granted, or None if not
+	# enough is left.
+	def try_reserve(self, amount, minimum=None):
+		minimum=amount if minimum is None else minimum
+		token='%d.%d.%d' % (os.getpid(), threading.current_thread().ident, next(self._tokens))
+		def reserve(reservations):
+			capacity=self.capacity() if callable(self.capacity) else self.capacity
+			left=capacity-sum(reserved for pid, reserved_token, reserved in reservations)
+			if reservations and left < minimum:
+				return None
+			granted=min(amount, left) if reservations else amount
+			reservations.append((os.getpid(), token, granted))
+			return token, granted
+		return self._update(reserve)
+
+	# Change the amount of a reservation, such as once part of it is no longer needed.
+	def resize(self, token, amount):
+		def change(reservations):
+			reservations[:]=[(pid, reserved_token, amount if reserved_token==token else reserved)
+			                 for pid, reserved_token, reserved in reservations]
+		self._update(change)
+
+	# Release a reservation. There is nothing to release once the ledger is removed.
+	def release(self, token):
+		if not os.path.exists(self.path):
+			return
+		def remove(reservations):
+			reservations[:]=[reservation for reservation in reservations if reservation[1] != token]
+		self._update(remove)
+
+	# Reserve 'amount' of the budget, or at least 'minimum' of it, for the enclosed block,
+	# waiting until enough is left. The block is given the amount granted.
+	@contextmanager
+	def reserve(self, amount, minimum=None):
+		reservation=self.try_reserve(amount, minimum)
+		while reservation is None:
+			time.sleep(BUDGET_POLL)
+			reservation=self.try_reserve(amount, minimum)
+		token, granted=reservation
+		try:
+			yield granted
+		finally:
+			self.release(token)
@@ -0,0 +1,91 @@
+import os
+import re
+import sys
+import json
+import subprocess
+
+# File the results of the software probes are kept in, within the download cache folder.
+PROBE_FILE='software.json'
+
+
+class SoftwareError(Exception):
+	pass
+
+# Full path of the executable 'name' found on the PATH, None if there is none.
+def find_binary(name):
+	for directory in os.environ.get('PATH', '').split(os.pathsep):
+		path=os.path.join(directory, name)
+		if os.path.isfile(path) and os.access(path, os.X_OK):
+			return path
+	return None
+
+# Check that ASCP is installed and configured. Returns its version line.
+def probe_ascp(path):
+	try:
+		output=subprocess.check_output([path, "-A"])
+	except (OSError, subprocess.CalledProcessError):
+		raise SoftwareError('ASCP not installed or configured. Please install/configure ASCP.')
+	return output.strip().splitlines()[0] if output.strip() else ''
+
+# Check that Java(x64) greater than version 1.8 is installed. Returns its version.
+def probe_java(path):
+	try:
+		output=subprocess.check_output([path, "-d64", "-version"], stderr=subprocess.STDOUT)
+	except (OSError, subprocess.CalledProcessError):
+		raise SoftwareError('64-bit Java not installed. Please install 64-bit java.')
+	versions=re.findall('"([^"]*)"', output.splitlines()[0]) if output else []
+	if not versions or versions[0]<'1.8':
+		raise SoftwareError('Java verson 1.8 or greater required.')
+	return versions[0]
+
+PROBES={'ascp': probe_ascp, 'java': probe_java}
+
+# Binary a probe result is kept for: the file the executable resolves to, with its
+# modification time and size, so that the probe runs again once it is replaced or upgraded.
+def _probe_key(path):
+	real_path=os.path.realpath(path)
+	stat=os.stat(real_path)
+	return [real_path, stat.st_mtime, stat.st_size]
+
+def _load_probes(probe_path):
+	if not probe_path or not os.path.exists(probe_path):
+		return dict()
+	try:
+		with open(probe_path) as _file:
+			return json.load(_file)
+	except ValueError:
+		return dict()
+
+def _save_probes(probe_path, probes):
+	try:
+		if not os.path.isdir(os.path.dirname(probe_path)):
+			os.makedirs(os.path.dirname(probe_path))
+		partial_path=probe_path+'.part'
+		with open(partial_path, 'w') as _file:
+			json.dump(probes, _file, sort_keys=True)
+		os.rename(partial_path, probe_path)
+	except (IOError, OSError) as e:
+		print('Unable to save the software checks to %s: %s' % (probe_path, e))
+
+# Check that the software run by the stages of the pipeline is installed, only probing the
+# binaries that changed since they were last checked. The results of the checks that passed
+# are kept in 'probe_path', if given. Exits if any of the software is missing.
+def check_software_dependencies(names=('ascp', 'java'), probe_path=None):
+	probes=_load_probes(probe_path)
+	changed=False
+	for name in names:
+		path=find_binary(name)
+		key=_probe_key(path) if path else None
+		if key is not None and probes.get(name, dict()).get('key')==key:
+			continue
+		print('checking software dependency '+name)
+		try:
+			version=PROBES[name](path or name)
+		except SoftwareError as e:
+			print(str(e))
+			sys.exit(1)
+		probes[name]={'key': key, 'version': version}
+		changed=True
+	if changed and probe_path:
+		_save_probes(probe_path, probes)
+	return dict((name, probes[name]['version']) for name in names)
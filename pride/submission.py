@@ -0,0 +1,93 @@
+from collections import namedtuple
+
+FileRecord = namedtuple("FileRecord", "file_id file_type file_path")
+SampleRecord = namedtuple("SampleRecord", "file_id species tissue instrument experimental_factor")
+
+# Column headers of the File Mapping and Sample Metadata sections of submission.px
+FILE_MAPPING_HEADER = ("file_id", "file_type", "file_path", "file_mapping")
+SAMPLE_METADATA_HEADER = ("file_id", "species", "tissue", "instrument", "experimental_factor")
+
+# Size of the write buffer of the submission.px file.
+WRITE_BUFFER = 1024*1024
+
+# Utility function to format list type metadata the way PRIDE expects it.
+def list_type_metadata(data):
+	data_string='['
+	for item in data:
+		data_string += str(item)
+	data_string += ']'
+	return data_string
+
+
+class Submission(object):
+	""" The files and sample metadata of the submission of a single study.
+
+	Files and samples are kept as compact records in the order they are added, and every
+	result file id is indexed to the ids of the raw files mapped to it, so that submission.px
+	can be written in one pass over the records. A file is listed once, whichever results it
+	is mapped to.
+	"""
+
+	def __init__(self):
+		self.files=list()
+		self.samples=list()
+		self._mapping=dict()
+		self._ids=dict()
+
+	# Add a file to the File Mapping section and return its id. A file that was already added
+	# keeps its id. Raw files are mapped to the result file with id 'result_id'.
+	def add_file(self, file_type, file_path, result_id=0):
+		id = self._ids.get(file_path)
+		if id is None:
+			id = len(self.files) + 1
+			self.files.append(FileRecord(id, file_type, file_path))
+			self._ids[file_path] = id
+		if(file_type=="raw" and id not in self._mapping.get(result_id, ())):
+			self._mapping.setdefault(result_id, list()).append(id)
+		return id
+
+	# Replace the path of a file in the File Mapping section, such as by that of its
+	# compressed copy. Files are found by their path, in constant time.
+	def rename_file(self, file_path, new_path):
+		id = self._ids.pop(file_path, None)
+		if id is None:
+			return
+		self.files[id-1]=self.files[id-1]._replace(file_path=new_path)
+		self._ids[new_path]=id
+
+	# Add the sample metadata of the result file with id 'result_id'.
+	def add_sample(self, result_id, species, tissue, instrument, experimental_factor):
+		self.samples.append(SampleRecord(result_id, species, tissue, instrument, experimental_factor))
+
+	# Ids of the raw files mapped to the result file with id 'result_id'.
+	def mapped_files(self, result_id):
+		return self._mapping.get(result_id, list())
+
+	# Write the submission.px file with the project metadata, file mapping and sample metadata.
+	def write(self, path, project_metadata):
+		with open(path, 'w', WRITE_BUFFER) as submission_file:
+			# Adding Project Metadata to the summary file.
+			for entry in project_metadata:
+				data = project_metadata[entry]
+				if (type(data) is str):
+					submission_file.write('MTD\t' + entry + '\t' + data + '\n')
+				else:
+					submission_file.write('MTD\t' + entry + '\t' + list_type_metadata(data) + '\n')
+
+			# Adding File Mapping data to the summary file.
+			submission_file.write('\nFMH\t' + '\t'.join(FILE_MAPPING_HEADER) + '\t\n')
+			for record in self.files:
+				line = 'FME\t'+str(record.file_id)+'\t'+record.file_type+'\t'+record.file_path+'\t'
+				if(record.file_type=="result"):
+					for id in self.mapped_files(record.file_id):
+						line += str(id)+','
+				submission_file.write(line + '\n')
+
+			# Adding Sample Metadata to the result file.
+			submission_file.write('\nSMH\t' + '\t'.join(SAMPLE_METADATA_HEADER) + '\t\n')
+			for record in self.samples:
+				submission_file.write('SME\t' + str(record.file_id) + '\t' +
+				                      list_type_metadata(record.species) + '\t' +
+				                      list_type_metadata(record.tissue) + '\t' +
+				                      list_type_metadata(record.instrument) + '\t' +
+				                      record.experimental_factor + '\n')
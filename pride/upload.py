@@ -0,0 +1,171 @@
+import os
+import re
+import time
+import heapq
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from .metrics import throughput
+from .slots import SharedBudget
+
+# Multipliers of the Kbps unit of the ascp transfer rate suffixes.
+RATE_UNITS={'': 1, 'K': 1, 'M': 1000, 'G': 1000000}
+
+# Aspera destination of the PRIDE directory of the submitter.
+def pride_destination(pride_user, pride_server, pride_directory):
+	return pride_user+'@'+pride_server+':/'+pride_directory
+
+# Aspera destination of the study folder in the PRIDE directory of the submitter, which is
+# where an upload of the whole result folder would place its files.
+def study_destination(result_dir, pride_user, pride_server, pride_directory):
+	return pride_destination(pride_user, pride_server, pride_directory.rstrip('/')+'/'+os.path.basename(result_dir))
+
+# Transfer rate in Kbps of an ascp rate such as '500M'.
+def rate_kbps(rate):
+	match=re.match(r'^(\d+(?:\.\d+)?)([KMG]?)$', str(rate).upper())
+	if match is None:
+		raise ValueError('Invalid transfer rate: %s' % rate)
+	return int(float(match.group(1))*RATE_UNITS[match.group(2)])
+
+# Split files into 'shards' lists of about the same total size, largest files first.
+def shard_files(paths, shards):
+	sizes=sorted(((os.path.getsize(path), path) for path in paths), reverse=True)
+	heap=[(0, shard) for shard in range(min(shards, len(sizes)))]
+	groups=[list() for shard in heap]
+	for size, path in sizes:
+		total, shard=heapq.heappop(heap)
+		groups[shard].append(path)
+		heapq.heappush(heap, (total+size, shard))
+	return groups
+
+# Sources among 'sources' that ascp reported as completely transferred in its progress output,
+# one '<file name> 100% ...' line per file.
+def completed_files(output, sources):
+	names=dict((os.path.basename(source), source) for source in sources)
+	completed=set()
+	for line in re.split(r'[\r\n]+', output or ''):
+		fields=line.split()
+		if len(fields) > 1 and fields[0] in names and fields[1]=='100%':
+			completed.add(names[fields[0]])
+	return completed
+
+# Utility function to submit files or folders to PRIDE via ASPERA. Returns the sources that
+# were transferred: all of them if ascp reported success, else those that ascp reported as
+# completed in its output.
+def ascp_upload(sources, destination, pride_pw, create_dir=False, rate='500M'):
+	environ=os.environ.copy()
+	# Set the environment password for ASPERA transfers as the one provided by the user.
+	environ['ASPERA_SCP_PASS'] = pride_pw
+	ascp_cmd=["ascp","-QT", "-l"+str(rate), "--file-manifest=text", "-k", "2", "-o", "Overwrite=diff"]
+	if create_dir:
+		ascp_cmd.append("-d")
+	try:
+		process = subprocess.Popen(ascp_cmd + list(sources) + [destination], stdout=subprocess.PIPE,
+		                           stdin=subprocess.PIPE,
+		                           stderr=subprocess.PIPE,
+		                           universal_newlines=True,
+		                           env=environ)
+
+		(s_out, s_err) = process.communicate()
+		rc = process.returncode
+
+		if rc == 0:
+			print("Aspera ascp utility returned successful exit value.")
+			return set(sources)
+		else:
+			if re.match(r"^.*failed to authenticate", s_err):
+				print("Aspera authentication failure.")
+			else:
+				if s_err != None:
+					print("Unexpected STDERR from ascp: %s" % s_err)
+				if s_out != None:
+					print("Unexpected STDOUT from ascp: %s" % s_out)
+			return completed_files(s_out, sources)
+
+	except (OSError, subprocess.CalledProcessError) as cpe:
+		print("Encountered an error when running ascp: ", cpe)
+	return set()
+
+
+class UploadScheduler(object):
+	""" Uploads files to PRIDE in several concurrent ascp sessions.
+
+	The files are split into 'sessions' shards of about the same total size, every session
+	gets an equal part of the aggregate 'bandwidth' and only the files that ascp did not
+	report as transferred are retried, up to 'retries' times. Every ascp session is timed in
+	'metrics', if given. With a 'slot_dir', the bandwidth is shared by the sessions of every
+	process of the node: a session gets its part of what is left of it, and waits until at
+	least half of its part is left.
+	"""
+
+	def __init__(self, destination, pride_pw, sessions=4, bandwidth='500M', retries=2, metrics=None, slot_dir=None):
+		self.destination=destination
+		self.pride_pw=pride_pw
+		self.sessions=int(sessions)
+		self.bandwidth=rate_kbps(bandwidth)
+		self.retries=int(retries)
+		self.metrics=metrics
+		self.budget=None
+		if slot_dir:
+			self.budget=SharedBudget(os.path.join(slot_dir, 'upload_bandwidth'), self.bandwidth)
+
+	# Upload the files and return the ones that could not be uploaded.
+	def upload(self, paths):
+		pending=list(paths)
+		for attempt in range(self.retries + 1):
+			if not pending:
+				break
+			if attempt:
+				print('Retrying upload of %d files (attempt %d of %d)' % (len(pending), attempt, self.retries))
+			shards=shard_files(pending, self.sessions)
+			rate=max(1, self.bandwidth // len(shards))
+			pool=ThreadPool(len(shards))
+			try:
+				completed=pool.map(lambda shard: self._upload_shard(shard, rate, attempt), shards)
+			finally:
+				pool.close()
+				pool.join()
+			completed=set().union(*completed)
+			pending=[path for path in pending if path not in completed]
+		return pending
+
+	def _upload_shard(self, shard, rate, attempt):
+		if self.budget is None:
+			return self._upload_shard_at(shard, rate, attempt)
+		with self.budget.reserve(rate, max(1, rate // 2)) as granted:
+			return self._upload_shard_at(shard, granted, attempt)
+
+	def _upload_shard_at(self, shard, rate, attempt):
+		if self.metrics is None:
+			return ascp_upload(shard, self.destination, self.pride_pw, create_dir=True, rate=rate)
+		size=sum(os.path.getsize(path) for path in shard)
+		start=time.time()
+		completed=ascp_upload(shard, self.destination, self.pride_pw, create_dir=True, rate=rate)
+		seconds=time.time()-start
+		self.metrics.record('ascp_upload', files=len(shard), completed=len(completed), bytes=size, rate_kbps=rate,
+		                    attempt=attempt, seconds=round(seconds, 3), mb_per_s=round(throughput(size, seconds), 3))
+		return completed
+
+
+class StreamingUploader(object):
+	""" Uploads the files of each validated proteome to the study folder in the PRIDE directory
+	on their own, so that they can be uploaded while the remaining proteomes are still being
+	downloaded and validated.
+	"""
+
+	def __init__(self, result_dir, pride_user, pride_pw, pride_server, pride_directory,
+	             upload_sessions=4, upload_bandwidth='500M', upload_retries=2, journal=None, metrics=None, slot_dir=None):
+		self.scheduler=UploadScheduler(study_destination(result_dir, pride_user, pride_server, pride_directory),
+		                               pride_pw, upload_sessions, upload_bandwidth, upload_retries, metrics, slot_dir)
+		self.journal=journal
+
+	# Upload a list of files, those of the proteome 'proteome_id' if given. Returns the files
+	# that could not be uploaded.
+	def upload(self, paths, proteome_id=None):
+		print('Uploading '+', '.join(os.path.basename(path) for path in paths))
+		failed=self.scheduler.upload(paths)
+		if self.journal is not None:
+			self.journal.files_uploaded(set(paths) - set(failed))
+			if proteome_id is not None and not failed:
+				self.journal.set_step(proteome_id, 'uploaded')
+		return failed
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import select
+import sqlite3
+import subprocess
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+from .checksum import file_checksum
+from .slots import SharedBudget
+
+CODE_DIR=os.path.dirname(os.path.abspath(__file__))
+CONVERTER_VERSION='pg-converter-1.2'
+CONVERTER_JAR=os.path.join(CODE_DIR,CONVERTER_VERSION,'pg-converter.jar')
+SERVICE_SCRIPT=os.path.join(CODE_DIR,'validator_service.js')
+
+READY_MARKER='@@pg-converter-ready@@'
+DONE_MARKER='@@pg-converter-done@@'
+
+# Seconds the validator service is given to start, and to answer a validation request: at
+# least VALIDATION_TIMEOUT, plus VALIDATION_TIMEOUT_PER_MB per MB of result and peak file. A
+# service that does not answer in time is killed and the validation run in a JVM of its own.
+SERVICE_START_TIMEOUT=300
+VALIDATION_TIMEOUT=600
+VALIDATION_TIMEOUT_PER_MB=30
+
+# Counts of the validation report that must be at least one for a usable submission.
+REPORT_TOTALS=['Total proteins','Total peptides','Total spectra']
+
+# JVM heap estimates, in MB: at least MIN_HEAP, else HEAP_MARGIN times the memory predicted
+# for the input from earlier runs, as a base footprint plus a memory per MB of input. Until
+# runs of inputs of different sizes have been recorded, the memory per MB of input is taken
+# as DEFAULT_HEAP_RATIO.
+MIN_HEAP=512
+DEFAULT_HEAP_RATIO=4.0
+HEAP_MARGIN=1.25
+HEAP_HISTORY=50
+MB=1024*1024
+
+# Heap of a validator service sharing the memory budget with other processes, as a multiple of
+# the heap estimated for its first validation.
+SERVICE_HEAP_MARGIN=2
+
+# Three quarters of the physical memory of the node, in MB.
+def default_memory_budget():
+	return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 3 / 4 / MB)
+
+# Resident memory figure 'field' of /proc/<pid>/status, e.g. VmHWM for the peak resident
+# memory, in MB. Returns None if it cannot be read, as outside Linux.
+def process_memory(pid, field):
+	try:
+		with open('/proc/%d/status' % pid) as status:
+			for line in status:
+				if line.startswith(field+':'):
+					return int(line.split()[1]) / 1024.0
+	except (IOError, OSError, ValueError, IndexError):
+		pass
+	return None
+
+# Reset the peak resident memory of a process to its current resident memory. Returns whether
+# it was reset, which needs Linux 4.0 or later.
+def reset_peak_memory(pid):
+	try:
+		with open('/proc/%d/clear_refs' % pid, 'w') as clear_refs:
+			clear_refs.write('5')
+		return True
+	except (IOError, OSError):
+		return False
+
+# Arguments of a pg-converter run validating a result file against its peak file.
+def converter_arguments(result_path, peak_path, report_path):
+	return ['-v','-mzid',result_path,'-peak',peak_path,'-skipserialization','-reportfile',report_path]
+
+# Read the outcome of a validation, its Status and the totals, from a pg-converter report.
+def read_report(report_path):
+	outcome=dict()
+	with open(report_path) as _file:
+		for line in _file:
+			tags=line.strip('\n').split(':')
+			if tags[0] in REPORT_TOTALS:
+				outcome[tags[0]]=int(tags[1].strip(' '))
+			elif tags[0]=='Status':
+				outcome[tags[0]]=tags[1].strip(' ')
+	return outcome
+
+
+class ServiceError(Exception):
+	pass
+
+
+class Converter(object):
+	""" Runs pg-converter validations.
+
+	In 'service' mode a single validator JVM is started and reused for every run, which saves
+	the JVM start up, the class loading of the converter libraries and the JIT warm up on all
+	but the first validation. In 'process' mode, or if the service cannot be started or stops
+	responding, every run starts a new JVM as 'java -jar pg-converter.jar' does.
+	"""
+
+	def __init__(self, mode='service', service_heap=None, start=True):
+		self.mode=mode
+		self.service_heap=service_heap
+		self._service=None
+		self._lock=threading.Lock()
+		if mode=='service' and start:
+			self.start_service(service_heap)
+
+	# Start the validator service in a JVM with a heap of 'heap' MB, unless it is running.
+	# Returns whether it is running.
+	def start_service(self, heap=None):
+		with self._lock:
+			if self._service is None and self.mode=='service':
+				self.service_heap=heap
+				try:
+					self._start_service()
+				except (OSError, ServiceError) as e:
+					print('Unable to start the validator service (%s), starting one JVM per validation.' % e)
+					self._stop_service()
+					self.mode='process'
+			return self._service is not None
+
+	# Whether the validator service would run a validation needing a heap of 'heap' MB: it
+	# only runs those that fit in its own heap.
+	def serves(self, heap=None):
+		return self._service is not None and (not heap or not self.service_heap or heap <= self.service_heap)
+
+	# Run pg-converter with the given arguments, in a JVM with a heap of 'heap' MB when it
+	# starts a new one. Returns the peak resident memory in MB of the JVM that ran it, or None
+	# if it could not be measured. Raises subprocess.CalledProcessError if the converter exits
+	# with a non zero status. The service is given 'timeout' seconds to answer, by default
+	# VALIDATION_TIMEOUT.
+	def run(self, arguments, heap=None, timeout=None):
+		with self._lock:
+			if self.serves(heap):
+				try:
+					return self._run_service(arguments, timeout or VALIDATION_TIMEOUT)
+				except ServiceError as e:
+					print('Validator service failed (%s), starting one JVM per validation.' % e)
+					self._stop_service()
+					self.mode='process'
+		return self._run_process(arguments, heap)
+
+	def _run_process(self, arguments, heap):
+		java_cmd=['java']
+		if heap:
+			java_cmd.append('-Xmx%dm' % heap)
+		with open(os.devnull, 'w') as devnull:
+			process=subprocess.Popen(java_cmd+['-jar',CONVERTER_JAR]+arguments, stdout=devnull)
+			pid, status, rusage=os.wait4(process.pid, 0)
+		process.returncode=os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+		if process.returncode != 0:
+			raise subprocess.CalledProcessError(process.returncode, 'pg-converter '+' '.join(arguments))
+		# ru_maxrss is in KB on Linux.
+		return rusage.ru_maxrss / 1024.0
+
+	# Stop the validator service, if it is running. The next call to start_service starts a
+	# new one.
+	def stop_service(self):
+		with self._lock:
+			self._stop_service()
+
+	def close(self):
+		self.stop_service()
+
+	def _start_service(self):
+		java_cmd=['java']
+		if self.service_heap:
+			java_cmd.append('-Xmx%dm' % self.service_heap)
+		self._service=subprocess.Popen(java_cmd+['-cp',CONVERTER_JAR,'jdk.nashorn.tools.Shell',SERVICE_SCRIPT],
+		                               stdin=subprocess.PIPE,
+		                               stdout=subprocess.PIPE)
+		self._output=''
+		self._read_until(READY_MARKER, SERVICE_START_TIMEOUT)
+
+	# Run a validation in the validator service. Returns the peak resident memory of the
+	# service JVM during the validation: its high water mark is reset before the request, down
+	# to what the JVM kept of earlier validations, so the figure may be above what the
+	# validation alone needed. Where it cannot be reset, the high water mark is only returned
+	# if the validation raised it.
+	def _run_service(self, arguments, timeout):
+		pid=self._service.pid
+		reset=reset_peak_memory(pid)
+		start_peak=process_memory(pid, 'VmHWM')
+		try:
+			self._service.stdin.write('\t'.join(arguments)+'\n')
+			self._service.stdin.flush()
+		except IOError as e:
+			raise ServiceError(e)
+		return_code=int(self._read_until(DONE_MARKER, timeout).split()[1])
+		if return_code != 0:
+			raise subprocess.CalledProcessError(return_code, 'pg-converter '+' '.join(arguments))
+		peak_mb=process_memory(pid, 'VmHWM')
+		if peak_mb is None or (not reset and (start_peak is None or peak_mb <= start_peak)):
+			return None
+		return peak_mb
+
+	# Skip the converter output up to the given marker line and return that line. The output
+	# is read from the pipe as it comes, so that a service that does not print the marker
+	# within 'timeout' seconds can be killed rather than waited for.
+	def _read_until(self, marker, timeout):
+		deadline=time.time()+timeout
+		descriptor=self._service.stdout.fileno()
+		while True:
+			while '\n' in self._output:
+				line, self._output=self._output.split('\n', 1)
+				if line.startswith(marker):
+					return line.rstrip('\r')
+			remaining=deadline-time.time()
+			if remaining <= 0 or not select.select([descriptor], [], [], remaining)[0]:
+				self._service.kill()
+				raise ServiceError('validator service did not answer within %d seconds' % timeout)
+			data=os.read(descriptor, 65536)
+			if not data:
+				raise ServiceError('validator service exited with status %s' % self._service.wait())
+			self._output+=data
+
+	def _stop_service(self):
+		if self._service is None:
+			return
+		try:
+			self._service.stdin.close()
+		except IOError:
+			pass
+		if self._service.poll() is None:
+			self._service.wait()
+		self._service=None
+
+
+class ValidationCache(object):
+	""" Persistent store of validation outcomes, keyed by the checksums of the result and
+	peak files and by the converter version, so that unchanged pairs of files are not
+	validated again on later runs.
+	"""
+
+	def __init__(self, path):
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		self._lock=threading.Lock()
+		self._db=sqlite3.connect(path, check_same_thread=False)
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS outcomes (result TEXT, peak TEXT, converter TEXT, outcome TEXT, '
+			                 'PRIMARY KEY (result, peak, converter))')
+
+	# Key of the outcome of validating the given files. The MD5 checksums recorded when the
+	# files were downloaded are used if given, and only files without one are read.
+	def key(self, result_path, peak_path, result_md5=None, peak_md5=None):
+		return (result_md5 or file_checksum(result_path), peak_md5 or file_checksum(peak_path), CONVERTER_VERSION)
+
+	# The outcome recorded for the key, or None if these files were not validated before.
+	def get(self, key):
+		with self._lock:
+			row=self._db.execute('SELECT outcome FROM outcomes WHERE result=? AND peak=? AND converter=?', key).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0])
+
+	def put(self, key, outcome):
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?)', key + (json.dumps(outcome),))
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+
+class HeapHistory(object):
+	""" Input sizes and peak resident memory of earlier pg-converter runs, kept in the
+	validation database when there is one, used to estimate the heap of the next runs.
+	"""
+
+	def __init__(self, path=None):
+		self._lock=threading.Lock()
+		self._db=sqlite3.connect(path or ':memory:', check_same_thread=False)
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS runs (input_mb REAL, heap_mb INTEGER, peak_mb REAL)')
+
+	def record(self, input_mb, heap_mb, peak_mb):
+		with self._lock:
+			with self._db:
+				self._db.execute('INSERT INTO runs VALUES (?, ?, ?)', (input_mb, heap_mb, peak_mb))
+
+	# Memory in MB predicted for a run on 'input_mb' MB of input, from the most recent runs:
+	# a least squares fit of their peak memory as a base footprint of the JVM plus a memory
+	# per MB of input, with the base raised so that none of these runs is above the fit.
+	def predict(self, input_mb):
+		with self._lock:
+			rows=self._db.execute('SELECT input_mb, peak_mb FROM runs WHERE input_mb > 0 ORDER BY rowid DESC LIMIT ?',
+			                      (HEAP_HISTORY,)).fetchall()
+		if not rows:
+			return DEFAULT_HEAP_RATIO * input_mb
+		mean_input=sum(row[0] for row in rows) / len(rows)
+		mean_peak=sum(row[1] for row in rows) / len(rows)
+		spread=sum((row[0]-mean_input)**2 for row in rows)
+		if spread > 0:
+			slope=max(0.0, sum((row[0]-mean_input)*(row[1]-mean_peak) for row in rows) / spread)
+		else:
+			slope=DEFAULT_HEAP_RATIO
+		base=max(0.0, max(peak_mb - slope*row_input for row_input, peak_mb in rows))
+		return base + slope * input_mb
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+
+class ValidationScheduler(object):
+	""" Admission control for concurrent pg-converter runs.
+
+	The JVM heap of every run is estimated from the sizes of its result and peak files and
+	the memory used by earlier runs. A run only starts once its heap fits in what is left of
+	'memory_budget' MB, and at most 'workers' runs, no more than the number of CPUs, are
+	admitted at once. A run larger than the whole budget is admitted alone with the budget
+	as its heap. The peak resident memory of every run, in the validator service as in JVMs of
+	their own, is recorded in the history when it can be measured.
+
+	With a 'slot_dir', the memory budget and the workers are shared by the validations of
+	every process of the node. A validator service is then only started once its heap can be
+	reserved, and keeps it reserved until the scheduler is closed; the validations it cannot
+	run are run in JVMs of their own, and if one of them does not fit in what the other
+	processes left of the budget, the service is stopped to release its heap.
+	"""
+
+	def __init__(self, converter, workers=1, memory_budget=None, history=None, slot_dir=None):
+		self.converter=converter
+		self.workers=max(1, min(int(workers), multiprocessing.cpu_count()))
+		self.memory_budget=int(memory_budget or default_memory_budget())
+		self.history=history or HeapHistory()
+		self._condition=threading.Condition()
+		self._running=0
+		self._reserved=0
+		self._memory=None
+		self._slots=None
+		self._service_token=None
+		if slot_dir:
+			self._memory=SharedBudget(os.path.join(slot_dir, 'validation_memory'), self.memory_budget)
+			self._slots=SharedBudget(os.path.join(slot_dir, 'validation_workers'), self.workers)
+
+	# Heap in MB for a validation of the given files.
+	def estimate(self, result_path, peak_path):
+		input_mb=(os.path.getsize(result_path) + os.path.getsize(peak_path)) / float(MB)
+		heap=max(MIN_HEAP, int(HEAP_MARGIN * self.history.predict(input_mb)))
+		return min(heap, self.memory_budget)
+
+	@contextmanager
+	def _admit(self, heap, service=False):
+		if self._memory is not None:
+			# The memory is reserved before the worker slot, so that no slot is held while
+			# waiting for the heap of a validator service to be released.
+			if service:
+				with self._slots.reserve(1):
+					yield
+				return
+			reservation=self._memory.try_reserve(heap)
+			if reservation is None and self._service_token is not None:
+				# The heap of the validator service of this process may be what the
+				# validation is waiting for, so the service is stopped rather than waited for.
+				print('Stopping the validator service to release its memory for a %d MB validation.' % heap)
+				self.converter.stop_service()
+				self._release_service()
+			if reservation is None:
+				with self._memory.reserve(heap):
+					with self._slots.reserve(1):
+						yield
+				return
+			try:
+				with self._slots.reserve(1):
+					yield
+			finally:
+				self._memory.release(reservation[0])
+			return
+		with self._condition:
+			while self._running and (self._running >= self.workers or self._reserved + heap > self.memory_budget):
+				self._condition.wait()
+			self._running+=1
+			self._reserved+=heap
+		try:
+			yield
+		finally:
+			with self._condition:
+				self._running-=1
+				self._reserved-=heap
+				self._condition.notify_all()
+
+	# Start the validator service with the whole memory budget as its heap, or with a heap
+	# of SERVICE_HEAP_MARGIN times 'heap' if the budget is shared and that much of it is left.
+	def _start_service(self, heap):
+		if self._memory is None:
+			self.converter.start_service(self.memory_budget)
+			return
+		reservation=self._memory.try_reserve(min(self.memory_budget, heap*SERVICE_HEAP_MARGIN), heap)
+		if reservation is None:
+			return
+		token, granted=reservation
+		if self.converter.start_service(granted):
+			self._service_token=token
+		else:
+			self._memory.release(token)
+
+	def _release_service(self):
+		if self._service_token is not None and not self.converter.serves():
+			self._memory.release(self._service_token)
+			self._service_token=None
+
+	# Run a pg-converter validation of the given files once it is admitted. Returns the peak
+	# resident memory of the JVM that ran it in MB, or None if it could not be measured.
+	def run(self, arguments, result_path, peak_path):
+		heap=self.estimate(result_path, peak_path)
+		input_mb=(os.path.getsize(result_path) + os.path.getsize(peak_path)) / float(MB)
+		if self.converter.mode=='service' and not self.converter.serves():
+			self._start_service(heap)
+		try:
+			with self._admit(heap, self.converter.serves(heap)):
+				peak_mb=self.converter.run(arguments, heap, VALIDATION_TIMEOUT + VALIDATION_TIMEOUT_PER_MB*input_mb)
+		finally:
+			self._release_service()
+		if peak_mb is not None:
+			self.history.record(input_mb, heap, peak_mb)
+		return peak_mb
+
+	def close(self):
+		self.converter.close()
+		self._release_service()
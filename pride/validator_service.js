@@ -0,0 +1,59 @@
+// Long-lived pg-converter validator, run under the Nashorn shell of the JVM:
+//
+//   java -cp pg-converter.jar jdk.nashorn.tools.Shell validator_service.js
+//
+// Reads one tab separated pg-converter argument list per line on stdin, runs the converter
+// main class inside this JVM and answers every request with a '@@pg-converter-done@@ <code>'
+// line on stdout. Calls to System.exit() made by the converter are trapped and reported as
+// the exit code of the request.
+
+var MainApp = Java.type("uk.ac.ebi.pride.toolsuite.pgconverter.MainApp");
+var System = Java.type("java.lang.System");
+var BufferedReader = Java.type("java.io.BufferedReader");
+var InputStreamReader = Java.type("java.io.InputStreamReader");
+var SecurityException = Java.type("java.lang.SecurityException");
+
+var EXIT_PREFIX = "pg-converter-exit:";
+
+var ExitTrap = Java.extend(Java.type("java.lang.SecurityManager"), {
+	checkExit: function(status) {
+		throw new SecurityException(EXIT_PREFIX + status);
+	},
+	checkPermission: function() {}
+});
+
+function exitCode(error) {
+	var cause = error;
+	while (cause != null) {
+		var message = String(cause.getMessage ? cause.getMessage() : cause.message);
+		if (message.indexOf(EXIT_PREFIX) == 0) {
+			return parseInt(message.substring(EXIT_PREFIX.length));
+		}
+		cause = cause.getCause ? cause.getCause() : null;
+	}
+	System.err.println("pg-converter failed: " + error);
+	return 1;
+}
+
+System.setSecurityManager(new ExitTrap());
+System.out.println("@@pg-converter-ready@@");
+System.out.flush();
+
+var input = new BufferedReader(new InputStreamReader(System.in));
+var line;
+while ((line = input.readLine()) != null) {
+	if (line.length == 0) {
+		continue;
+	}
+	var code = 0;
+	try {
+		MainApp.main(Java.to(line.split("\t"), "java.lang.String[]"));
+	} catch (error) {
+		code = exitCode(error);
+	}
+	System.out.println();
+	System.out.println("@@pg-converter-done@@ " + code);
+	System.out.flush();
+}
+
+System.setSecurityManager(null);
@@ -1,240 +1,722 @@
 import os
 import sys
-import inspect
-import subprocess
-import re
-from collections import OrderedDict
-from urlparse import urlparse
-
-import cutlass.aspera as asp
-
-file_mapping=OrderedDict([
-	("file_id", list()),
-	("file_type", list()),
-	("file_path", list()),
-	("file_mapping", list()),
-])
-
-sample_metadata=OrderedDict([
-	("file_id", list()),
-	("species", list()),            # Field 'species' from
-									# corresponding assey_prep
-	("tissue", list()),             # Field 'tissue' from
-									# corresponding assey_prep
-	("instrument", list()),         # Field 'instrument_name' from
-									# proteome OSDF entry
-	("experimental_factor", list()) # Field 'exp_description' from
-									# proteome OSDF entry
-])
-
-# Called for each assay_prep present in the study to download and validate files
-# from each proteome instance included in the assay_prep.
-def collect(session, prepprot, result_dir, dcc_user, dcc_pw, study_id):
-
+import time
+import atexit
+import threading
+
+from .cache import DownloadCache
+from .checksum import MANIFEST_NAME, checksum_files, write_manifest
+from .compression import GZIP_EXTENSION, compression_ratio, gzip_file
+from .download import DownloadPool, local_name
+from .journal import is_journal_file
+from .metrics import Metrics, load_events
+from .plan import StudyPlan, file_sizes, recorded_rates
+from .precheck import precheck
+from .slots import SharedBudget, slot_dir
+from .upload import UploadScheduler, study_destination
+from .validation import Converter, HeapHistory, ValidationCache, ValidationScheduler, REPORT_TOTALS
+from .validation import converter_arguments, default_memory_budget, read_report
+
+# Utility function to read a yes/no workflow option, which is a string when given on the
+# command line.
+def option_flag(value):
+	return str(value).lower() in ('true', 'yes', '1')
+
+class ProcessLocal(object):
+	""" Object created on first use in every process that runs pipeline tasks.
+
+	The anadama runner may run tasks in forked worker processes, in which the threads and
+	database connections of the parent cannot be used, so the download pool, caches and
+	validator of a run are created by each process for the tasks it runs. The limits they
+	enforce are shared by the processes through the SharedBudget files of the run.
+	"""
+
+	def __init__(self, factory, close=None):
+		self._factory=factory
+		self._close=close
+		self._lock=threading.Lock()
+		self._pid=None
+		self._value=None
+
+	def get(self):
+		with self._lock:
+			if self._pid != os.getpid():
+				self._value=self._factory()
+				self._pid=os.getpid()
+				if self._close is not None:
+					atexit.register(self._close, self._value)
+			return self._value
+
+# Data files of the result folder to submit: every file but submission.px, the checksum
+# manifest, the run journal and the files in 'compressed', which are submitted as their
+# compressed copies.
+def data_files(result_dir, compressed=()):
+	return [os.path.join(result_dir, name) for name in sorted(os.listdir(result_dir))
+	        if name not in ('submission.px', MANIFEST_NAME) and not is_journal_file(name) and name not in compressed
+	        and os.path.isfile(os.path.join(result_dir, name))]
+
+# Name of a task of the given stage, for a proteome or for the whole study of 'result_dir'.
+def task_name(stage, result_dir, proteome_id=None):
+	return stage+'_'+(proteome_id or os.path.basename(result_dir))
+
+# Workflow options of the collect stage that configure the CollectResources of a run.
+RESOURCE_OPTIONS=('dcc_user', 'dcc_pw', 'download_workers', 'host_workers', 'download_retries', 'download_batch_size',
+                  'validation_mode', 'validation_workers', 'validation_memory', 'cache_dir', 'cache_size', 'disk_limit')
+
+# Seconds between two checks of the disk use while waiting for it to drop below the limit.
+DISK_POLL=5
+
+# Proteomes after the one being downloaded whose files are queued for download as well, so
+# that they are transferred while it is validated and uploaded.
+PREFETCH_PROTEOMES=4
+
+
+class CollectResources(object):
+	""" Download pool, caches and validator of a run, shared by the tasks of all the studies
+	submitted in the run and created on first use by every process that runs them. The
+	transfers per DCC host, the memory and workers of the validations and the upload bandwidth
+	are bounded over all these processes by budgets kept in 'slot_dir'.
+
+	With a 'disk_limit' in GB, the files of the result folders of the run and the download
+	cache are kept under that limit: a proteome only starts downloading once the space its
+	files are expected to take can be reserved on top of what they use and of the reservations
+	of the proteomes being processed, unless no other proteome is being processed that would
+	free space. Downloads are timed in 'metrics', if given.
+	"""
+
+	def __init__(self, dcc_user, dcc_pw, download_workers=4, host_workers=2, download_retries=3,
+	             download_batch_size=0, validation_mode='service', validation_workers=1, validation_memory=None,
+	             cache_dir=None, cache_size=0, disk_limit=0, metrics=None):
+		self.dcc_user=dcc_user
+		self.dcc_pw=dcc_pw
+		self.download_workers=int(download_workers)
+		self.host_workers=int(host_workers)
+		self.download_retries=int(download_retries)
+		self.download_batch_size=int(download_batch_size)
+		self.validation_mode=validation_mode
+		self.validation_workers=int(validation_workers)
+		self.memory_budget=int(validation_memory or default_memory_budget())
+		self.cache_dir=os.path.expanduser(cache_dir) if cache_dir else None
+		self.cache_size=float(cache_size)
+		self.disk_limit=int(float(disk_limit)*1024**3)
+		self.metrics=metrics
+		self.slot_dir=slot_dir(self.cache_dir)
+		self.studies=list()
+		self.downloads=ProcessLocal(self._create_download_pool, lambda pool: pool.close())
+		self._disk=None
+		if self.disk_limit:
+			self._disk=SharedBudget(os.path.join(self.slot_dir, 'disk'), lambda: self.disk_limit-self.disk_usage())
+		self.validators=ProcessLocal(self._create_validator, lambda validator: validator[0].close())
+
+	# Register the result folder and journal of a study submitted in the run.
+	def add_study(self, result_dir, journal):
+		self.studies.append((result_dir, journal))
+
+	# Bytes used by the files of the result folders of the run and by the download cache.
+	# Files of the result folders are links to the cached objects, so every file is counted
+	# once whatever the number of its links.
+	def disk_usage(self):
+		paths=list()
+		for result_dir, journal in self.studies:
+			paths.extend(os.path.join(result_dir, name) for name in os.listdir(result_dir))
+		if self.cache_dir and self.cache_size > 0:
+			for directory, directories, names in os.walk(os.path.join(self.cache_dir, 'objects')):
+				paths.extend(os.path.join(directory, name) for name in names)
+		usage=0
+		counted=set()
+		for path in paths:
+			try:
+				stat=os.stat(path)
+			except OSError:
+				continue
+			if os.path.isdir(path) or (stat.st_dev, stat.st_ino) in counted:
+				continue
+			counted.add((stat.st_dev, stat.st_ino))
+			usage+=stat.st_size
+		return usage
+
+	# Sizes of the files of 'file_urls', as a list of (url, file name, size, source of the
+	# size) with a size of None when it is unknown, taken from the result folder, else from the
+	# download cache.
+	def file_sizes(self, file_urls, result_dir):
+		cache=self.downloads.get().cache
+		return file_sizes(file_urls, result_dir, cache.sizes() if cache is not None else dict())
+
+	# Reserve 'size' bytes of the disk limit for a proteome, waiting while the disk use and
+	# the reservations of the proteomes being processed by any process leave less than that,
+	# as long as they will free space. A size of None, for files of unknown size, waits until
+	# no other proteome is being processed. Returns the token of the reservation.
+	def reserve_disk(self, proteome_id, size):
+		amount=self.disk_limit if size is None else size
+		reservation=self._disk.try_reserve(amount)
+		if reservation is None:
+			print 'Disk limit reached, waiting for uploads to complete before downloading proteome '+proteome_id
+		while reservation is None:
+			time.sleep(DISK_POLL)
+			reservation=self._disk.try_reserve(amount)
+		return reservation[0]
+
+	def resize_disk(self, token, size):
+		self._disk.resize(token, size)
+
+	def release_disk(self, token):
+		self._disk.release(token)
+
+	# Files downloaded by earlier runs are taken from the download cache, which is disabled
+	# with a size of 0. With a disk limit, the cache is kept to half of the limit.
+	def _create_download_pool(self):
+		cache = None
+		if self.cache_dir and self.cache_size > 0:
+			max_size = int(self.cache_size*1024**3)
+			if self.disk_limit:
+				max_size = min(max_size, self.disk_limit // 2)
+			cache = DownloadCache(self.cache_dir, max_size)
+		return DownloadPool(self.dcc_user, self.dcc_pw, self.download_workers, self.host_workers, self.download_retries,
+		                    cache=cache, batch_size=self.download_batch_size, metrics=self.metrics, slot_dir=self.slot_dir)
+
+	# Validations run concurrently as long as their estimated JVM heaps fit in the memory
+	# budget, which is shared with the validations of the other processes. A single
+	# validation worker reuses one validator JVM for all the proteomes validated by a process,
+	# while concurrent workers start a JVM with its own heap size for every validation.
+	def _create_validator(self):
+		validation_cache = None
+		heap_history = None
+		if self.cache_dir:
+			validation_cache = ValidationCache(os.path.join(self.cache_dir, 'validation.db'))
+			heap_history = HeapHistory(os.path.join(self.cache_dir, 'validation.db'))
+		mode = self.validation_mode
+		if self.validation_workers > 1:
+			mode = 'process'
+		converter = Converter(mode, start=False)
+		return (ValidationScheduler(converter, self.validation_workers, self.memory_budget, heap_history, self.slot_dir),
+		        validation_cache)
+
+# Maps the files of each proteome instance included in the assay_preps of a study in the
+# submission, in proteome order, along with the sample metadata of their result files. Returns
+# the proteomes whose files are mapped along with the urls and local names of their files.
+# Distinct urls with the same file name cannot be downloaded next to each other, so the run
+# stops with the list of them.
+def map_files(submission, prepprots, result_dir):
 	# Utility function to update the File Mapping section of submission.px file
 	def update_file_mapping(file_type, file_name, result_id=0):
-		id = len(file_mapping["file_id"]) + 1
-		file_mapping["file_id"].append(id)
-		file_mapping["file_type"].append(file_type)
-		file_mapping["file_path"].append(result_dir+'/'+file_name)
-
-		if(file_type=="raw"):
-			mapping=str(result_id)+':'+str(id)
-			file_mapping["file_mapping"].append(mapping)
+		return submission.add_file(file_type, result_dir+'/'+file_name, result_id)
 
 	# Utility function to update the Sample Metadata section of submission.px file
-	def update_sample_metadata(result_id,proteome):
-		sample_metadata["file_id"].append(result_id)
-		sample_metadata["species"].append(prepprot.prep._species)
-		sample_metadata["tissue"].append(prepprot.prep._tissue)
-		sample_metadata["instrument"].append(proteome._instrument_name)
-		#sample_metadata["modification"].append('MOD,MOD:00394,acetylated residue,')
-		sample_metadata["experimental_factor"].append(proteome._exp_description)
-
-	# Utility function to download files from the url present in the proteome instances in OSDF
-	def download_file(file_url):
-		url = urlparse(file_url)
-		file_path = url.path.split('/')
-		if not os.path.exists(result_dir+'/'+file_path[len(file_path)-1]):
-			print 'Downloading file '+file_path[len(file_path)-1]+' to '+result_dir
-			if asp.download_file(url.netloc, dcc_user, dcc_pw, url.path, result_dir):
-				print 'Download Complete'
-				return file_path[len(file_path)-1]
-			else:
-				print 'Unable to download file ' + file_path[len(file_path)-1]
-				sys.exit(1)
-
-	# Utility function to download files from a single proteome instance and update the meatadata
-	# fields to be included in the submission.px file.
+	def update_sample_metadata(result_id,prepprot,proteome):
+		submission.add_sample(result_id, prepprot.prep._species, prepprot.prep._tissue,
+		                      proteome._instrument_name, proteome._exp_description)
+
+	# Utility function to resolve the url of a file to its local name. Every url is resolved
+	# once, whichever proteomes reference it. A different url with the name of an earlier one
+	# cannot be kept in the result folder next to it, and is recorded in 'conflicts'.
+	resolved=dict()
+	conflicts=list()
+	def resolve_file(file_url):
+		file_name = local_name(file_url)
+		if resolved.setdefault(file_name, file_url) != file_url:
+			conflicts.append((file_url, resolved[file_name]))
+		return file_name
+
+	# Utility function to map the files of a single proteome instance in the submission and
+	# update the meatadata fields to be included in the submission.px file. Returns the urls
+	# and local names of the files of the proteome, empty if the proteome is skipped. Files
+	# shared with earlier proteomes keep their id and are mapped to this result as well.
 	# Note: Assuming that only one result set (i.e. one mzid result file and its corresponding
-	# single peak and raw files) is present per proteome instance in OSDF
-	def download_files():
-		result_id = 0
-		file_name=None
-		result_file=None
-		peak_file=None
-		for url in proteome._result_url:
-			result_file = download_file(url)
-			if not result_file is None:
-				result_id = len(file_mapping["file_id"]) + 1
-				update_file_mapping('result', result_file)
-				update_sample_metadata(result_id, proteome)
-				break
-
-		for url in proteome._peak_url:
-			peak_file = download_file(url)
-			if not peak_file is None:
-				# Validating that the peak file format is '.mgf'
-				if not peak_file.lower().endswith('.mgf'):
-					print 'Peak File is required to be in .mgf format'
-					sys.exit(1)
-				update_file_mapping('peak', peak_file)
-				break
-
-		for url in proteome._raw_url:
-			file_name = download_file(url)
-			if not file_name is None:
+	# single peak and raw files) is present per proteome instance in OSDF, the result and peak
+	# files are taken from the first of their urls.
+	results=set()
+	def map_proteome(prepprot, proteome):
+		result_file = resolve_file(proteome._result_url[0]) if proteome._result_url else None
+		peak_file = resolve_file(proteome._peak_url[0]) if proteome._peak_url else None
+		if result_file is None or peak_file is None:
+			print 'Result or peak file missing for proteome '+proteome._id+', skipping it.'
+			return list()
+		if result_file in results:
+			print 'Result file '+result_file+' of proteome '+proteome._id+' belongs to an earlier proteome, skipping it.'
+			return list()
+		results.add(result_file)
+
+		# Validating that the peak file format is '.mgf'
+		if not peak_file.lower().endswith('.mgf'):
+			print 'Peak File is required to be in .mgf format'
+			sys.exit(1)
+
+		result_id = update_file_mapping('result', result_file)
+		update_sample_metadata(result_id, prepprot, proteome)
+		update_file_mapping('peak', peak_file)
+		files = [(proteome._result_url[0], result_file), (proteome._peak_url[0], peak_file)]
+
+		for url in proteome._raw_url + proteome._other_url:
+			file_name = resolve_file(url)
+			if not file_name is None and (url, file_name) not in files:
 				update_file_mapping('raw', file_name, result_id)
-
-		if not len(proteome._other_url) == 0:
-			for url in proteome._other_url:
-				file_name = download_file(url)
-				if not file_name is None:
-					update_file_mapping('raw', url, result_id)
-
-		return result_file,peak_file
-
-	def validate_files(result_file, peak_file,proteome):
-		print 'Validating Proteome '+proteome._id
-		code_dir=os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))+'/pg-converter-1.2/pg-converter.jar'
-		return_code=subprocess.check_output(['java','-jar',code_dir,'-v','-mzid',result_dir+'/'+result_file,'-peak',result_dir+'/'+peak_file,
-		                                     '-skipserialization','-reportfile',result_dir+'/'+'validation_result_'+proteome._id+'.txt'])
-		tag_check_list = ['Total proteins','Total peptides','Total spectra']
-		with open(result_dir+'/'+'validation_result_'+proteome._id+'.txt') as _file:
-			for line in _file.readlines():
-				tags=line.strip('\n').split(':')
-				if tags[0] in tag_check_list and int(tags[1].strip(' '))<1:
-					print tags[0], ' cannot be found for proteome ', proteome._id
-					print 'Chceck submission folder for related validation test result file.'
-					# sys.exit(1)
-				if tags[0]=='Status' and tags[1].strip(' ') != 'OK':
-					print 'Result file could not be validated for proteome ', proteome._id
-					print 'Chceck submission folder for related validation test result file.'
+				files.append((url, file_name))
+
+		return files
+
+	mapped=list()
+	for prepprot in prepprots:
+		for proteome in prepprot.proteome:
+			files = map_proteome(prepprot, proteome)
+			if files:
+				mapped.append((proteome, files))
+
+	# The study cannot be submitted without some of its files if they share their name.
+	if conflicts:
+		print 'The following files of the study have the name of another of its files:'
+		for file_url, other_url in conflicts:
+			print '\t'+file_url+' (same name as '+other_url+')'
+		sys.exit(1)
+	return mapped
+
+# Ids of the proteomes referencing every file mapped by map_files, by local file name, in
+# proteome order. The first of them downloads and uploads the file.
+def file_owners(mapped):
+	owners=dict()
+	for proteome, files in mapped:
+		for url, file_name in files:
+			owners.setdefault(file_name, list()).append(proteome._id)
+	return owners
+
+# Called once for all the assay_preps present in the study. Maps the files of each proteome
+# instance included in them in the submission, in proteome order, and yields the anadama tasks
+# that download them, validate the result and peak files and, in streaming mode, upload the
+# files of the validated proteome. Tasks of different proteomes are independent, so the
+# runner can process as many proteomes at once as it has jobs, and skips the downloads whose
+# files are present and the validations and uploads the journal records as done. The
+# files are downloaded and validated with the 'resources' shared by the studies of the run,
+# and every stage of every proteome is timed in 'metrics', if given.
+def collect(session, submission, prepprots, result_dir, resources, study_id, force_validation=False, precheck_files=True,
+            compress_files=False, compression_workers=0, compression_threshold=0.8, uploader=None, journal=None,
+            metrics=None):
+	if metrics is None:
+		metrics = Metrics()
+
+	# Utility function to download the files of a single proteome instance. The files are
+	# queued together so that they can share ascp sessions, followed by the 'prefetch_urls'
+	# of the next proteomes, which are downloaded while this one is processed.
+	def download_files(proteome_id, file_urls, prefetch_urls=()):
+		with metrics.stage('download', study_id, proteome_id, files=len(file_urls)) as event:
+			pool = resources.downloads.get()
+			jobs = pool.fetch_all(file_urls, result_dir, journal)
+			if prefetch_urls:
+				pool.prefetch(prefetch_urls, result_dir, journal)
+			file_names = [job.get() for job in jobs]
+			event['bytes'] = sum(os.path.getsize(result_dir+'/'+file_name) for file_name in file_names if file_name is not None)
+		missing = [url for url, file_name in zip(file_urls, file_names) if file_name is None]
+		if missing:
+			print 'The following files of proteome '+proteome_id+' could not be downloaded:'
+			for url in missing:
+				print '\t'+url
+			return False
+		if journal is not None:
+			journal.set_step(proteome_id, 'downloaded')
+		return True
+
+	# Utility function giving the MD5 checksum computed when a file was downloaded, from the
+	# journal or else from the download pool of this process, or None if it has none.
+	def recorded_md5(file_name):
+		if journal is not None:
+			return journal.file_md5(file_name)
+		checksums = resources.downloads.get().checksums.get(result_dir+'/'+file_name)
+		return checksums[0] if checksums else None
+
+	def validate_files(result_file, peak_file, proteome_id):
+		print 'Validating Proteome '+proteome_id
+		report_file=result_dir+'/'+'validation_result_'+proteome_id+'.txt'
+		scheduler, validation_cache = resources.validators.get()
+
+		# Files that are unchanged since an earlier validation are not validated again.
+		key=None
+		outcome=None
+		if validation_cache is not None:
+			key=validation_cache.key(result_dir+'/'+result_file, result_dir+'/'+peak_file,
+			                         recorded_md5(result_file), recorded_md5(peak_file))
+			if not option_flag(force_validation):
+				outcome=validation_cache.get(key)
+		if outcome is None:
+			# A quick streaming pass over the files catches empty or mismatched inputs before
+			# the much slower pg-converter run.
+			if option_flag(precheck_files):
+				with metrics.stage('precheck', study_id, proteome_id):
+					counts, problems=precheck(result_dir+'/'+result_file, result_dir+'/'+peak_file)
+				if problems:
+					print 'Result file could not be validated for proteome ', proteome_id
+					for problem in problems:
+						print '\t'+problem
 					sys.exit(1)
-		_file.close()
-		try:
-			os.remove(result_dir+'/'+'validation_result_'+proteome._id+'.txt')
-		except OSError, e:
-			print ("Error removing validation result file: %s - %s." % (e.filename, e.strerror))
+			with metrics.timer('converter', study=study_id, proteome=proteome_id) as event:
+				peak_mb=scheduler.run(converter_arguments(result_dir+'/'+result_file,result_dir+'/'+peak_file,report_file),
+				                      result_dir+'/'+result_file, result_dir+'/'+peak_file)
+				outcome=read_report(report_file)
+				event['peak_mb']=peak_mb
+				event['bytes']=os.path.getsize(result_dir+'/'+result_file)+os.path.getsize(result_dir+'/'+peak_file)
+				event.update((tag.lower().replace(' ', '_'), outcome.get(tag)) for tag in REPORT_TOTALS)
+				event['status']=outcome.get('Status')
+			if key is not None:
+				validation_cache.put(key, outcome)
+			check_message='Chceck submission folder for related validation test result file.'
+		else:
+			print 'Files unchanged since an earlier validation, reusing its result.'
+			check_message='Rerun with collect.force_validation:true to recreate the validation test result file.'
+
+		for tag in REPORT_TOTALS:
+			if tag in outcome and outcome[tag]<1:
+				print tag, ' cannot be found for proteome ', proteome_id
+				print check_message
+				# sys.exit(1)
+		if outcome.get('Status', 'OK') != 'OK':
+			print 'Result file could not be validated for proteome ', proteome_id
+			print check_message
+			sys.exit(1)
+
+		if os.path.exists(report_file):
+			try:
+				os.remove(report_file)
+			except OSError, e:
+				print ("Error removing validation result file: %s - %s." % (e.filename, e.strerror))
 		print 'Validated. Ok!'
 
-	for proteome in prepprot.proteome:
-		result_file, peak_file = download_files()
-		validate_files(result_file,peak_file,proteome)
-
-# Function that creeates the submission.px file and then submits data to the PRIDE repository
-def submit(result_dir,project_metadata,pride_user,pride_pw,pride_server,pride_directory):
-	os.chdir(result_dir)
-
-	def fill_list_type_metadata(submission_file,data):
-		data_string='['
-		for item in data:
-			data_string += str(item)
-		data_string += ']'
-		submission_file.write(data_string)
+	# Utility function running validate_files as the action of a task. A failed validation
+	# fails the task, which keeps the runner from uploading and submitting the study.
+	def validation_job(result_file, peak_file, proteome_id):
+		try:
+			with metrics.stage('validation', study_id, proteome_id):
+				validate_files(result_file, peak_file, proteome_id)
+		except SystemExit:
+			return False
+		if journal is not None:
+			journal.set_step(proteome_id, 'validated')
+		return True
+
+	# Utility function to upload the files of a validated proteome in streaming mode. Files
+	# uploaded before an interrupted run stopped are not uploaded again.
+	def upload_files(proteome_id, file_names):
+		if journal is not None:
+			compressed = journal.compressed_files()
+			uploaded = journal.uploaded_files()
+			file_names = [compressed.get(file_name, file_name) for file_name in file_names]
+			file_names = [file_name for file_name in file_names if file_name not in uploaded]
+		if not file_names:
+			if journal is not None:
+				journal.set_step(proteome_id, 'uploaded')
+			return True
+		paths = [result_dir+'/'+file_name for file_name in file_names]
+		with metrics.stage('upload', study_id, proteome_id, files=len(paths), bytes=sum(os.path.getsize(path) for path in paths)):
+			return not uploader.upload(paths, proteome_id)
+
+	# Utility function to download, validate, compress and upload the files of a proteome in
+	# a single task when the disk is limited, and then remove them from the result folder.
+	# Only the files the proteome is the first to reference are downloaded, compressed and
+	# uploaded, and only those it is the last to reference are removed.
+	def stage_files(proteome_id, file_urls, file_names, own_names, last_names):
+		compressed_names = [file_name for file_name in file_names[:2] if file_name in own_names]
+		token = resources.reserve_disk(proteome_id, stage_size(resources.file_sizes(file_urls, result_dir),
+		                                                       compressed_names))
+		journal.set_active(proteome_id)
+		try:
+			if not download_files(proteome_id, file_urls):
+				return False
+			# The downloaded files now count in the disk use, so only the space of their
+			# compressed copies stays reserved.
+			resources.resize_disk(token, stage_size([(url, file_name, os.path.getsize(result_dir+'/'+file_name), 'local')
+			                                         for url, file_name in zip(file_urls, own_names)], compressed_names))
+			if not validation_job(file_names[0], file_names[1], proteome_id):
+				return False
+			if option_flag(compress_files):
+				compress_result_files(proteome_id, [name for name in file_names[:2] if name in own_names])
+			if not upload_files(proteome_id, own_names):
+				return False
+			# The files are only removed once PRIDE confirmed their upload.
+			compressed = journal.compressed_files()
+			for file_name in last_names + [compressed[name] for name in last_names if name in compressed]:
+				if os.path.exists(result_dir+'/'+file_name):
+					os.remove(result_dir+'/'+file_name)
+			print 'Removed the uploaded files of proteome '+proteome_id+' from the result folder.'
+			return True
+		finally:
+			journal.clear_active(proteome_id)
+			resources.release_disk(token)
+
+	# Utility function giving the bytes the staging of a proteome is expected to add to the
+	# disk use from the sizes of its files: the files to download, all but those in the result
+	# folder or the download cache, and the copies of 'compressed_names' compressed to at most
+	# 'compression_threshold' of their size. None if a file to download is of unknown size.
+	def stage_size(sizes, compressed_names):
+		size = 0
+		for file_url, file_name, file_size, source in sizes:
+			if file_size is None:
+				if source not in ('local', 'cache'):
+					return None
+				continue
+			if source not in ('local', 'cache'):
+				size += file_size
+			if option_flag(compress_files) and file_name in compressed_names:
+				size += int(file_size*float(compression_threshold))
+		return size
+
+	# Utility function to compress the result and peak files of a validated proteome before
+	# they are uploaded, recording the compressed copies in the journal. Files that would not
+	# compress below 'compression_threshold' of their size are uploaded as they are, and files
+	# the journal has a compressed copy of are not compressed again.
+	def compress_result_files(proteome_id, file_names):
+		compressed = journal.compressed_files() if journal is not None else dict()
+		for file_name in file_names:
+			if file_name in compressed:
+				continue
+			file_path = result_dir+'/'+file_name
+			ratio = compression_ratio(file_path)
+			if ratio > float(compression_threshold):
+				print 'Not compressing %s, it only compresses to %d%% of its size.' % (file_name, ratio*100)
+				continue
+			print 'Compressing '+file_name
+			with metrics.stage('compression', study_id, proteome_id, file=file_name, bytes=os.path.getsize(file_path)):
+				checksums = gzip_file(file_path, file_path+GZIP_EXTENSION, compression_workers)
+			if journal is not None:
+				journal.file_compressed(file_name, file_name+GZIP_EXTENSION, checksums)
+		return True
+
+	# Utility function telling the runner whether a proteome completed a step in the journal,
+	# so that the tasks of the steps completed by an interrupted run are skipped without
+	# reading their files.
+	def step_completed(proteome_id, step):
+		return journal is not None and journal.completed(proteome_id, step)
+
+	# When resuming an interrupted run, files left incomplete by that run are downloaded again.
+	if journal is not None:
+		journal.remove_partial_files(result_dir)
+	resources.add_study(result_dir, journal)
+
+	# Files can only be removed once uploaded if every proteome is uploaded on its own and
+	# the uploads are journaled.
+	if resources.disk_limit and (uploader is None or journal is None):
+		print 'A disk limit requires streaming uploads and a run journal.'
+		sys.exit(1)
+
+	# Files shared by several proteomes are downloaded, compressed and uploaded once, by the
+	# tasks of the first proteome referencing them, which the tasks of the others wait for.
+	# 'download_task' gives the task downloading every file.
+	mapped = map_files(submission, prepprots, result_dir)
+	owners = file_owners(mapped)
+	owned_urls = [[url for url, file_name in files if owners[file_name][0]==proteome._id] for proteome, files in mapped]
+	stage_task = dict()
+	download_task = dict()
+	proteome_tasks=list()
+	for index, (proteome, files) in enumerate(mapped):
+		file_names = [file_name for url, file_name in files]
+		own_urls = [url for url, file_name in files if owners[file_name][0]==proteome._id]
+		own_names = [file_name for url, file_name in files if owners[file_name][0]==proteome._id]
+		shared_from = sorted(set(owners[file_name][0] for file_name in file_names) - set([proteome._id]))
+
+		# With a disk limit the files of the proteome do not stay in the result folder, so
+		# its progress is tracked by the journal rather than by the files. A shared file is
+		# removed by the last proteome referencing it, whose task waits for the tasks of every
+		# other proteome referencing it so that none of them still needs the file.
+		if resources.disk_limit:
+			last_names = [file_name for file_name in file_names if owners[file_name][-1]==proteome._id]
+			waits_for = set(shared_from)
+			for file_name in last_names:
+				waits_for.update(owners[file_name])
+			waits_for.discard(proteome._id)
+			yield {
+				"name": task_name('stage', result_dir, proteome._id),
+				"actions": [(stage_files, [proteome._id, own_urls, file_names, own_names, last_names])],
+				"uptodate": [(journal.completed, [proteome._id, 'uploaded'])],
+				"task_dep": [stage_task[owner] for owner in sorted(waits_for)],
+			}
+			stage_task[proteome._id] = task_name('stage', result_dir, proteome._id)
+			proteome_tasks.append(task_name('stage', result_dir, proteome._id))
+			continue
+
+		# The result and peak files are downloaded on their own, so that validation starts as
+		# soon as they are in while the raw and other files are still being transferred. The
+		# files of the next proteomes are prefetched along with them.
+		prefetch_urls = [url for urls in owned_urls[index+1:index+1+PREFETCH_PROTEOMES] for url in urls]
+		for kind, kind_names in (('download', file_names[:2]), ('download_raw', file_names[2:])):
+			kind_files = [(url, file_name) for url, file_name in files if file_name in kind_names]
+			kind_own = [(url, file_name) for url, file_name in kind_files if file_name in own_names]
+			yield {
+				"name": task_name(kind, result_dir, proteome._id),
+				"actions": [(download_files, [proteome._id, [url for url, file_name in kind_own],
+				                              prefetch_urls if kind=='download' else ()])],
+				"targets": [result_dir+'/'+file_name for url, file_name in kind_own],
+				"uptodate": [True],
+				"task_dep": sorted(set(download_task[file_name] for url, file_name in kind_files
+				                       if file_name not in own_names)),
+			}
+			for url, file_name in kind_own:
+				download_task[file_name] = task_name(kind, result_dir, proteome._id)
+		proteome_tasks.append(task_name('download_raw', result_dir, proteome._id))
+		yield {
+			"name": task_name('validate', result_dir, proteome._id),
+			"actions": [(validation_job, [file_names[0], file_names[1], proteome._id])],
+			"uptodate": [(step_completed, [proteome._id, 'validated'])],
+			"task_dep": [task_name('download', result_dir, proteome._id)],
+		}
+		proteome_tasks.append(task_name('validate', result_dir, proteome._id))
+		if option_flag(compress_files):
+			yield {
+				"name": task_name('compress', result_dir, proteome._id),
+				"actions": [(compress_result_files, [proteome._id, [name for name in file_names[:2] if name in own_names]])],
+				"uptodate": [(step_completed, [proteome._id, 'uploaded'])],
+				"task_dep": [task_name('validate', result_dir, proteome._id)],
+			}
+			proteome_tasks.append(task_name('compress', result_dir, proteome._id))
+		if uploader is not None:
+			yield {
+				"name": task_name('upload', result_dir, proteome._id),
+				"actions": [(upload_files, [proteome._id, own_names])],
+				"uptodate": [(step_completed, [proteome._id, 'uploaded'])],
+				"task_dep": [proteome_tasks[-1], task_name('download_raw', result_dir, proteome._id)],
+			}
+			proteome_tasks.append(task_name('upload', result_dir, proteome._id))
+
+	# The study is collected once every proteome is validated, and uploaded in streaming mode.
+	yield {
+		"name": task_name('collect', result_dir),
+		"actions": None,
+		"task_dep": proteome_tasks,
+	}
+
+# Yields the tasks that create the submission.px file and the checksum manifest and then
+# submit data to the PRIDE repository once the study is collected. In streaming mode the data
+# files were already uploaded by the tasks of each proteome and only the submission.px file
+# and the manifest are submitted. Each of these steps is timed in 'metrics', if given, and the
+# upload bandwidth is shared with the other processes of the node through 'slot_dir', if given.
+def submit(submission,result_dir,project_metadata,pride_user,pride_pw,pride_server,pride_directory,
+           upload_sessions=4, upload_bandwidth='500M', upload_retries=2, checksum_workers=4, uploader=None,
+           journal=None, metrics=None, slot_dir=None):
+	submission_path=os.path.join(result_dir, 'submission.px')
+	manifest_path=os.path.join(result_dir, MANIFEST_NAME)
+	study_id=os.path.basename(result_dir)
+	if metrics is None:
+		metrics=Metrics()
 
 	# Utility function to create and populate the submission.px file
 	def _create_submission_file():
-		submission_file_name = 'submission.px'
 		try:
-			os.remove(submission_file_name)
+			os.remove(submission_path)
 			print 'Removing old submission file'
 		except OSError:
 			pass
 
-		submission_file = open(submission_file_name, "a+")
-		# Adding Project Metadata to the summary file.
-		for entry in project_metadata:
-			data = project_metadata[entry]
-			if (type(data) is str):
-				submission_file.write('MTD\t' + entry + '\t' + project_metadata[entry] + '\n')
-			else:
-				data_string = 'MTD\t' + entry + '\t['
-				for item in data:
-					data_string += str(item)
-				data_string += ']\n'
-				submission_file.write(data_string)
-
-		# Adding File Mapping data to the summary file.
-		submission_file.write('\nFMH\t')
-
-		for entry in file_mapping:
-			submission_file.write(entry+'\t')
-		submission_file.write('\n')
-
-		for id in file_mapping["file_id"]:
-			submission_file.write('FME\t'+str(id)+'\t'+file_mapping["file_type"][id-1]+'\t'+file_mapping["file_path"][id-1]+'\t')
-			if(file_mapping["file_type"][id-1]=="result"):
-				for mapping in file_mapping["file_mapping"]:
-					splits=mapping.split(':')
-					if splits[0]==str(id):
-						submission_file.write(splits[1]+',')
-			submission_file.write('\n')
-
-		# Adding Sample Metadata to the result file.
-		submission_file.write('\nSMH\t')
-
-		for entry in sample_metadata:
-			submission_file.write(entry + '\t')
-		submission_file.write('\n')
-
-		for id in range(len(sample_metadata["file_id"])):
-			submission_file.write('SME\t')
-			submission_file.write(str(sample_metadata["file_id"][id])+'\t')
-			fill_list_type_metadata(submission_file,sample_metadata["species"][id])
-			submission_file.write('\t')
-			fill_list_type_metadata(submission_file, sample_metadata["tissue"][id])
-			submission_file.write('\t')
-			fill_list_type_metadata(submission_file, sample_metadata["instrument"][id])
-			submission_file.write('\t')
-
-			submission_file.write(sample_metadata["experimental_factor"][id])
-			submission_file.write('\n')
-
-		submission_file.close()
-
-	# Utility function to submit all the data and submission summary file to PRIDE cia ASPERA
+		# Compressed files are submitted under the name of their compressed copy.
+		if journal is not None:
+			for file_name, compressed_name in journal.compressed_files().items():
+				submission.rename_file(result_dir+'/'+file_name, result_dir+'/'+compressed_name)
+		with metrics.stage('submission_file', study_id):
+			submission.write(submission_path, project_metadata)
+
+	# Utility function to create the checksum manifest of the data files. The checksums of
+	# downloaded files were computed right after their download, those of any other file are
+	# computed here by several threads.
+	def _create_manifest():
+		with metrics.stage('manifest', study_id):
+			_write_manifest()
+
+	def _write_manifest():
+		checksums=dict()
+		compressed=dict()
+		if journal is not None:
+			checksums=journal.checksums()
+			compressed=journal.compressed_files()
+		paths=data_files(result_dir, compressed)
+		missing=[path for path in paths if os.path.basename(path) not in checksums]
+		for path, file_checksums in checksum_files(missing, checksum_workers).items():
+			checksums[os.path.basename(path)]=file_checksums
+		# Files removed from the result folder after their upload are listed all the same.
+		file_names=set(os.path.basename(path) for path in paths)
+		if journal is not None:
+			file_names.update(name for name in journal.uploaded_files() if name not in compressed)
+		write_manifest(manifest_path, dict((file_name, checksums[file_name]) for file_name in file_names))
+
+	# Utility function to submit all the data and submission summary file to PRIDE cia ASPERA.
+	# The data files are sent first, in several concurrent sessions, unless they were already
+	# streamed during collection, and the manifest and submission.px file are sent last.
 	def _submit_data():
-		environ=os.environ.copy()
-		# Set the environment password for ASPERA transfers as the one provided by the user.
-		environ['ASPERA_SCP_PASS'] = pride_pw
-		# The command used to submit data to PRIDE.
-		# print "ascp", "-QT", "-l500M", "--file-manifest=text", "-k", "2", "-o", "Overwrite=diff", result_dir, pride_user + '@' + pride_server + ':/' + pride_directory
-		try:
-			ascp_cmd=["ascp","-QT", "-l500M", "--file-manifest=text", "-k", "2", "-o", "Overwrite=diff", result_dir, pride_user+'@'+pride_server+':/'+pride_directory]
-			process = subprocess.Popen(ascp_cmd, stdout=subprocess.PIPE,
-			                           stdin=subprocess.PIPE,
-			                           stderr=subprocess.PIPE,
-			                           universal_newlines=True,
-			                           env=environ)
-
-			(s_out, s_err) = process.communicate()
-			rc = process.returncode
-
-			if rc == 0:
-				print("Aspera ascp utility returned successful exit value.")
-			else:
-				if re.match(r"^.*failed to authenticate", s_err):
-					print("Aspera authentication failure.")
-				else:
-					if s_err != None:
-						print("Unexpected STDERR from ascp: %s" % s_err)
-					if s_out != None:
-						print("Unexpected STDOUT from ascp: %s" % s_out)
-
-		except subprocess.CalledProcessError as cpe:
-			print("Encountered an error when running ascp: ", cpe)
-
-
-	_create_submission_file()
-	_submit_data()
\ No newline at end of file
+		with metrics.stage('submit', study_id):
+			submitted=_upload_submission()
+		if submitted and journal is not None:
+			journal.set_submitted()
+		return submitted
+
+	def _upload_submission():
+		scheduler=UploadScheduler(study_destination(result_dir, pride_user, pride_server, pride_directory), pride_pw,
+		                          upload_sessions, upload_bandwidth, upload_retries, metrics, slot_dir)
+		if uploader is None:
+			# Files uploaded before an interrupted run stopped are not uploaded again.
+			uploaded=set()
+			compressed=dict()
+			if journal is not None:
+				uploaded=journal.uploaded_files()
+				compressed=journal.compressed_files()
+			paths=[path for path in data_files(result_dir, compressed) if os.path.basename(path) not in uploaded]
+			failed=scheduler.upload(paths)
+			if journal is not None:
+				journal.files_uploaded(set(paths) - set(failed))
+			if failed:
+				print 'The following files could not be uploaded, not submitting submission.px:'
+				for path in failed:
+					print '\t'+path
+				return False
+		return not scheduler.upload([manifest_path, submission_path])
+
+	yield {
+		"name": task_name('submission_file', result_dir),
+		"actions": [_create_submission_file, _create_manifest],
+		"targets": [submission_path, manifest_path],
+		"task_dep": [task_name('collect', result_dir)],
+	}
+	yield {
+		"name": task_name('submit', result_dir),
+		"actions": [_submit_data],
+		"file_dep": [submission_path, manifest_path],
+		"task_dep": [task_name('submission_file', result_dir)],
+	}
+
+# Yields the task that plans the submission of a study without downloading, validating or
+# uploading anything: it writes the files that would be submitted, with their size, and a
+# preview of the submission.px file next to the result folder, and prints the volume of every
+# stage and its time estimated from the rates recorded in 'metrics' by earlier runs.
+def plan(submission, prepprots, result_dir, project_metadata, resources, metrics, upload_sessions=4,
+         upload_bandwidth='500M', journal=None):
+	study_id=os.path.basename(result_dir)
+	plan_path=result_dir+'.plan.tsv'
+	preview_path=result_dir+'.plan.px'
+	mapped=map_files(submission, prepprots, result_dir)
+
+	def _plan():
+		cached_sizes=dict()
+		if resources.cache_dir and os.path.exists(os.path.join(resources.cache_dir, 'index.db')):
+			cache=DownloadCache(resources.cache_dir, int(resources.cache_size*1024**3))
+			cached_sizes=cache.sizes()
+			cache.close()
+		uploaded=journal.uploaded_files() if journal is not None else ()
+		study_plan=StudyPlan(study_id, result_dir, [(proteome._id, [url for url, file_name in files])
+		                                            for proteome, files in mapped], cached_sizes, uploaded,
+		                       use_cache=resources.cache_size > 0)
+		study_plan.write(plan_path)
+		submission.write(preview_path, project_metadata)
+		study_plan.report(recorded_rates(load_events(metrics.path)), resources.download_workers, resources.host_workers,
+		                  resources.validation_workers, upload_sessions, upload_bandwidth)
+		print('	file plan written to '+plan_path+', submission.px preview to '+preview_path)
+
+	yield {
+		"name": task_name('plan', result_dir),
+		"actions": [_plan],
+	}
+
+# Yields the task that prints where the time of the run went once every study of the run is
+# submitted, and writes the totals of the run to the Prometheus 'textfile', if given.
+def report(metrics, result_dirs, textfile=None):
+	def _report():
+		events=metrics.events()
+		metrics.summary(events)
+		if textfile:
+			metrics.write_textfile(textfile, events)
+
+	yield {
+		"name": "report",
+		"actions": [_report],
+		"task_dep": [task_name('submit', result_dir) for result_dir in result_dirs],
+	}
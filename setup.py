@@ -19,7 +19,7 @@ setup(
         'osdf-python',
         'cutlass'
     ],
-    package_data={'': ['.anadama_pride','pg-converter-1.2/*.*','pg-converter-1.2/lib/*.*']},
+    package_data={'': ['.anadama_pride','validator_service.js','pg-converter-1.2/*.*','pg-converter-1.2/lib/*.*']},
     include_package_data=True,
     entry_points= {
         'anadama.pipeline': [